@@ -1,7 +1,20 @@
-from fabric.api import cd, run, puts, local, settings, hide, prompt, abort, prefix
-from fabric.contrib.files import exists
+from fabric.api import cd, puts, local, settings, hide, prompt, abort, prefix
+from fabric.api import env
+from fabric.network import normalize
 from fabric import colors
+import fcntl
+import hashlib
+import math
 import os
+import posixpath
+from pipes import quote
+import time
+import urllib2
+
+from deploy_timing import run, put, get, timed
+
+# Directory of this file, the root of the local repository
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def _ensure_list(obj):
     """Always returns a list. If the original object is not a list, the
@@ -27,10 +40,79 @@ class BasicTarget(object):
     DB_SERVERS     = []
     DJANGO_DEPLOY_ENV = '' # Deploy environment for Django settings
 
+    # Parallel execution
+    PARALLEL       = False # Run the role tasks on many hosts at the same time
+    POOL_SIZE      = None  # Maximum number of concurrent hosts (None for all)
+    ROLE_POOL_SIZES = {}   # Pool size per role, e.g. {'app': 10}
+
+    # Collect only the static files that changed, under content-hashed names
+    # (manage.py collecthashed). Set STATICFILES_STORAGE to
+    # siteconfig.static_manifest.ManifestStaticFilesStorage to serve them.
+    HASHED_STATIC  = False
+
+    # Virtualenv provisioning. The virtualenv records the sha1 of the
+    # requirements file it was installed from, and is left alone while it does
+    # not change. With WHEELHOUSE, the packages are built into wheels only once
+    # per requirements file: 'local'ly, or on the first 'remote' host that
+    # needs them, and every host installs from a copy of them without
+    # downloading or building anything.
+    WHEELHOUSE     = None
+    LOCAL_WHEELHOUSE_DIR  = os.path.join(LOCAL_DIR, 'wheelhouse')
+    REMOTE_WHEELHOUSE_DIR = '~/.wheelhouse'
+    REQUIREMENTS_MARKER   = '.requirements_sha1' # In the virtualenv
+
+    # Directory of the JSON timing reports of the deploy tasks, or None
+    TIMING_REPORT_DIR = os.path.join(LOCAL_DIR, 'deploy_reports')
+
+    # Rolling restart of the application servers: they are restarted a batch
+    # at a time, and each batch must be ready before the next one is
+    # restarted. A host is ready when READINESS_URL answers 200 within
+    # READINESS_LATENCY seconds.
+    ROLLING_RESTART    = False
+    RESTART_BATCH_SIZE = 1    # Number of hosts, or a percentage such as '25%'
+    READINESS_URL      = 'http://%(host)s/' # %(host)s is the host name
+    READINESS_LATENCY  = 1.0  # Seconds
+    READINESS_TIMEOUT  = 120  # Seconds to wait for each host to be ready
+
+    # Database migrations run once per deploy, on a single host: MIGRATION_HOST
+    # or else the first of DB_SERVERS. Concurrent deploys wait for each other
+    # on a lock in the database (see manage.py dbupdate).
+    MIGRATION_HOST     = None
+
+    # SSH connections. Selecting the target opens the connections to all its
+    # hosts at the same time (except in parallel mode, see deploy_connections),
+    # and they send a keepalive every SSH_KEEPALIVE seconds (0 for none) so
+    # that they last the whole session.
+    SSH_WARM_UP        = True
+    SSH_KEEPALIVE      = 30
+
+    # Distribution of the code. With 'remote', every host clones and pulls from
+    # GIT_REPOSITORY, with clones GIT_CLONE_DEPTH commits deep (None for the
+    # whole history) and borrowing the objects of the repository at
+    # GIT_REFERENCE on the host, if any. With 'bundle', the hosts never reach
+    # GIT_REPOSITORY: the local repository bundles the commits the hosts are
+    # missing, once per deploy, and each host fetches them from its copy.
+    GIT_DISTRIBUTION   = 'remote'
+    GIT_CLONE_DEPTH    = None
+    GIT_REFERENCE      = None
+    LOCAL_BUNDLE_DIR   = os.path.join(LOCAL_DIR, 'bundles')
+
+    def __init__(self):
+        # Version of this deploy, the same on every host
+        self.deploy_version = time.strftime('%Y%m%d%H%M%S')
+        # Remote state of each host, see probe()
+        self._probes = {}
+
     # Directory getter members
     def _get_repository_dir(self):
         return self.REPOSITORY_DIR
 
+    def _get_project_dir(self):
+        """Directory the application runs from. It is the repository itself,
+        unless the target deploys releases.
+        """
+        return self._get_repository_dir()
+
     def _get_siteconfig_dir(self):
         return self.SITECONFIG_DIR
 
@@ -60,6 +142,98 @@ class BasicTarget(object):
             'static': self._get_static_servers(),
         }
 
+    def get_hosts(self):
+        """Returns every host of the target, once.
+        """
+        hosts = []
+        for role_hosts in self.get_roles().values():
+            hosts.extend(h for h in role_hosts if h not in hosts)
+        return hosts
+
+    def get_pool_size(self, role):
+        """Returns the number of hosts of the given role that may be worked on
+        at the same time in parallel mode. None means all of them.
+        """
+        return self.ROLE_POOL_SIZES.get(role, self.POOL_SIZE)
+
+    # Remote state
+
+    # Shell script printing the facts probe() returns, one "key=value" per line
+    PROBE_SCRIPT = (
+        "test -f ~/.ssh/id_rsa && echo ssh_key=1; "
+        "test -e %(venv)s && echo venv=1; "
+        "test -f %(marker)s && echo venv_requirements=$(cat %(marker)s); "
+        "echo wheelhouses=$(ls %(wheelhouse)s 2>/dev/null); "
+        "test -d %(repo)s/.git && cd %(repo)s && { "
+        "echo repo=1; "
+        "git update-index -q --ignore-submodules --refresh; "
+        "git diff-files --quiet --ignore-submodules"
+        " && git diff-index --cached --quiet HEAD --ignore-submodules --"
+        " || echo dirty=1; "
+        "echo branch=$(git symbolic-ref -q HEAD); "
+        "echo head=$(git rev-parse -q --verify HEAD); "
+        "test -f requirements.txt"
+        " && echo requirements=$(sha1sum < requirements.txt | cut -c1-40); "
+        "}; true")
+
+    def probe(self):
+        """Returns the state of the current host, gathered in a single command:
+
+        - ssh_key: whether the SSH private key exists;
+        - venv: whether the virtualenv exists;
+        - venv_requirements: the sha1 of the requirements file the virtualenv
+          was installed from, or '';
+        - wheelhouses: the requirements sha1 of the wheelhouses on the host;
+        - repo: whether the repository exists;
+        - dirty: whether the repository has uncommited changes;
+        - branch: the current branch of the repository, or '(none)';
+        - head: the sha of the HEAD commit, or '';
+        - requirements: the sha1 of requirements.txt, or '' if missing.
+
+        The state is kept until forget_probe() is called, so the routines may
+        call this freely.
+        """
+        host = env.host_string
+        if host not in self._probes:
+            venv = self._get_virtualenv_dir()
+            script = self.PROBE_SCRIPT % {
+                'repo': self._get_repository_dir(),
+                'venv': venv,
+                'marker': posixpath.join(venv, self.REQUIREMENTS_MARKER),
+                'wheelhouse': self.REMOTE_WHEELHOUSE_DIR,
+            }
+            with settings(hide('running', 'stdout')):
+                output = run(script)
+            self._probes[host] = self._parse_probe(output)
+        return self._probes[host]
+
+    def _parse_probe(self, output):
+        facts = {}
+        for line in output.splitlines():
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                facts[key] = value
+
+        branch = facts.get('branch', '')
+        if branch.startswith('refs/heads/'):
+            branch = branch[11:]
+        return {
+            'ssh_key': facts.get('ssh_key') == '1',
+            'venv': facts.get('venv') == '1',
+            'venv_requirements': facts.get('venv_requirements', ''),
+            'wheelhouses': facts.get('wheelhouses', '').split(),
+            'repo': facts.get('repo') == '1',
+            'dirty': facts.get('dirty') == '1',
+            'branch': branch or '(none)',
+            'head': facts.get('head', ''),
+            'requirements': facts.get('requirements', ''),
+        }
+
+    def forget_probe(self):
+        """Forget the state of the current host, after changing it.
+        """
+        self._probes.pop(env.host_string, None)
+
     # Routines
 
     def git_remote_exists(self, remote_name):
@@ -72,158 +246,329 @@ class BasicTarget(object):
         print remote_name in remotes
         return remote_name in remotes
 
+    def _show_public_key(self, message):
+        with settings(hide('running', 'stdout')):
+            pubkey = run('cat ~/.ssh/id_rsa.pub')
+
+        puts(colors.red(message))
+        puts('', show_prefix=False)
+        puts(pubkey, show_prefix=False)
+        puts('', show_prefix=False)
+
+    @timed
     def check_ssh_key(self):
         """Check for the presence of a SSH private key. If not, generate it and
         beg for the user to correctly add it to the repository.
         """
 
-        if not exists('~/.ssh/id_rsa'):
+        if not self.probe()['ssh_key']:
             puts(colors.yellow('Creating SSH private key'))
             # Generate the private/public key pair
             run("ssh-keygen -q -N '' -f ~/.ssh/id_rsa")
-
-            # Retrieve the public key
-            with settings(hide('running', 'stdout')):
-                pubkey = run('cat ~/.ssh/id_rsa.pub')
+            self.probe()['ssh_key'] = True
 
             # Beg the user to do the right thing with the key!
-
-            puts(colors.red('The following public key was generated:'))
-            puts('', show_prefix=False)
-            puts(pubkey, show_prefix=False)
-            puts('', show_prefix=False)
+            self._show_public_key('The following public key was generated:')
             prompt('Please add this SSH key to the repository and press any key'
                    ' to continue...')
 
+    @timed
     def setup_repository(self, force=False):
         """Creates the remote git repository and configures it to accept pushes
         to the current branch.
         """
         repo = self._get_repository_dir()
-        if exists(repo):
+        commands = []
+        if self.probe()['repo']:
             if force:
                 puts(colors.yellow('Repository already exists. Forced removing'
                                    ' it.'))
-                run('rm -rf ' + repo)
+                commands.append('rm -rf ' + repo)
             else:
                 puts(colors.red('Repository already exists. Refusing to'
                                 ' recreate it.'))
                 return
 
+        if self.GIT_DISTRIBUTION == 'bundle':
+            # Clone a bundle of the whole branch, and keep GIT_REPOSITORY as
+            # origin in case the distribution changes
+            bundle = self.build_bundle()
+            remote_bundle = '~/' + os.path.basename(bundle)
+            put(bundle, remote_bundle)
+            commands.append('git clone -q -b %s %s %s && rm -f %s'
+                            % (self.GIT_BRANCH, remote_bundle, repo,
+                               remote_bundle))
+            commands.append('cd %s && git remote set-url origin %s'
+                            % (repo, self.GIT_REPOSITORY))
+            run(' && '.join(commands))
+            self.forget_probe()
+            return
+
         # Check SSH keys
         self.check_ssh_key()
 
-        # Attempt to clone the remote repository
-        with settings(hide('warnings'), warn_only=True):
-            result = run('git clone ' + self.GIT_REPOSITORY + ' ' + repo)
-            if result.failed:
-                # Failed clone. Probably the SSH key has not been correctly
-                # added to the repository. Aid the user in this process
-                with settings(hide('running', 'stdout')):
-                    pubkey = run('cat ~/.ssh/id_rsa.pub')
-                puts(colors.red('Failed to clone repository! Your SSH Public'
-                               ' key is:'))
-                puts('', show_prefix=False)
-                puts(pubkey, show_prefix=False)
-                puts('', show_prefix=False)
-                abort('Cannot clone remote repository. Please check your public'
-                      ' key and try again. If you have just added the key,'
-                      ' please wait a few minutes before trying again.')
-
-        # Checkout the correct branch
-        if self.GIT_BRANCH != 'master':
-            with cd(repo):
-                run('git checkout -b %s origin/%s'
-                    % (self.GIT_BRANCH, self.GIT_BRANCH))
+        # Clone the remote repository on the correct branch
+        clone = 'git clone -b ' + self.GIT_BRANCH
+        if self.GIT_CLONE_DEPTH:
+            clone += ' --depth %d' % self.GIT_CLONE_DEPTH
+        if self.GIT_REFERENCE:
+            clone += ' --reference ' + self.GIT_REFERENCE
+        commands.append(clone + ' ' + self.GIT_REPOSITORY + ' ' + repo)
 
+        with settings(hide('warnings'), warn_only=True):
+            result = run(' && '.join(commands))
+        self.forget_probe()
+        if result.failed:
+            # Failed clone. Probably the SSH key has not been correctly
+            # added to the repository. Aid the user in this process
+            self._show_public_key('Failed to clone repository! Your SSH Public'
+                                  ' key is:')
+            abort('Cannot clone remote repository. Please check your public'
+                  ' key and try again. If you have just added the key,'
+                  ' please wait a few minutes before trying again.')
+
+    def _local_head(self):
+        with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+            head = local('git rev-parse -q --verify refs/heads/'
+                         + self.GIT_BRANCH, capture=True)
+        if head.failed:
+            abort('Cannot find the local branch %s.' % self.GIT_BRANCH)
+        return head
+
+    def build_bundle(self, basis=None):
+        """Builds a git bundle of GIT_BRANCH from the local repository and
+        returns its path. If the given basis commit is known locally, the bundle
+        only has the commits that are not in it. Each bundle is built once in
+        LOCAL_BUNDLE_DIR; when many hosts are deployed in parallel, the first
+        one builds it and the others wait for it.
+        """
+        head = self._local_head()
+        if basis:
+            with settings(hide('running', 'warnings'), warn_only=True):
+                if local('git cat-file -e %s^{commit}' % basis).failed:
+                    basis = None
+        name = '%s-%s.bundle' % (basis[:12] if basis else 'full', head[:12])
+        bundle = os.path.join(self.LOCAL_BUNDLE_DIR, name)
+        if os.path.exists(bundle):
+            return bundle
+
+        if not os.path.isdir(self.LOCAL_BUNDLE_DIR):
+            os.makedirs(self.LOCAL_BUNDLE_DIR)
+        lock_file = os.path.join(self.LOCAL_BUNDLE_DIR, '.lock')
+        with open(lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(bundle):
+                puts(colors.green('Bundling %s' % name))
+                revisions = 'refs/heads/' + self.GIT_BRANCH
+                if basis:
+                    revisions = basis + '..' + revisions
+                with settings(hide('running', 'stderr')):
+                    local('git bundle create %s.tmp %s && mv %s.tmp %s'
+                          % (bundle, revisions, bundle, bundle))
+        return bundle
+
+    @timed
     def setup_virtualenv(self, force=False):
         """Creates the virtualenv.
         """
         venv = self._get_virtualenv_dir()
-        if exists(venv):
+        commands = []
+        if self.probe()['venv']:
             if force:
                 puts(colors.yellow('Virtualenv already exists. Forced removing'
                                    ' it.'))
-                run('rm -rf ' + venv)
+                commands.append('rm -rf ' + venv)
             else:
                 puts(colors.red('Virtualenv already exists. Refusing to'
                                 ' recreate it.'))
                 return
 
-        run("virtualenv --no-site-packages " + venv)
+        commands.append("virtualenv --no-site-packages " + venv)
+        run(' && '.join(commands))
+        self.probe().update(venv=True, venv_requirements='')
 
-    def install_virtualenv(self, update=False):
-        """Install or updates the virtualenv according to the requirements file.
+    def _local_requirements_hash(self):
+        with open(os.path.join(LOCAL_DIR, 'requirements.txt'), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _build_remote_wheels(self, requirements_hash, local_dir):
+        """Builds the wheels on the current host and downloads them.
+        """
+        activate = os.path.join(self._get_virtualenv_dir(), 'bin/activate')
+        requirements = os.path.join(self._get_repository_dir(),
+                                    'requirements.txt')
+        remote_dir = posixpath.join(self.REMOTE_WHEELHOUSE_DIR,
+                                    requirements_hash)
+        puts(colors.green('Building wheels on %s' % env.host_string))
+        run("source %s && pip wheel -w %s -r %s"
+            % (activate, remote_dir, requirements))
+        self.probe()['wheelhouses'].append(requirements_hash)
+        get(posixpath.join(remote_dir, '*.whl'), local_dir)
+
+    @timed
+    def build_wheelhouse(self, requirements_hash):
+        """Builds the wheels of the requirements file of the given sha1 into
+        the local wheelhouse, unless they were already built, and returns its
+        directory. When many hosts are provisioned in parallel, the first one
+        builds the wheels and the others wait for it.
+        """
+        wheelhouse = os.path.join(self.LOCAL_WHEELHOUSE_DIR, requirements_hash)
+        complete = os.path.join(wheelhouse, '.complete')
+        if os.path.exists(complete):
+            return wheelhouse
+
+        if not os.path.isdir(self.LOCAL_WHEELHOUSE_DIR):
+            os.makedirs(self.LOCAL_WHEELHOUSE_DIR)
+        lock_file = os.path.join(self.LOCAL_WHEELHOUSE_DIR, '.lock')
+        with open(lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(complete):
+                tmp_dir = wheelhouse + '.tmp'
+                local('rm -rf %s %s && mkdir -p %s'
+                      % (tmp_dir, wheelhouse, tmp_dir))
+                if self.WHEELHOUSE == 'remote':
+                    self._build_remote_wheels(requirements_hash, tmp_dir)
+                else:
+                    puts(colors.green('Building wheels locally'))
+                    local('pip wheel -w %s -r %s' % (
+                        tmp_dir, os.path.join(LOCAL_DIR, 'requirements.txt')))
+                local('touch %s/.complete && mv %s %s'
+                      % (tmp_dir, tmp_dir, wheelhouse))
+        return wheelhouse
+
+    def _pip_install_command(self, requirements_hash, update=False,
+                             use_wheelhouse=False):
+        """Returns the command installing the requirements file of the given
+        sha1 into the virtualenv, from its wheelhouse if use_wheelhouse is
+        True, and recording the sha1 in the virtualenv.
         """
         venv = self._get_virtualenv_dir()
-        activate = os.path.join(venv, 'bin/activate')
         requirements = os.path.join(self._get_repository_dir(),
                                     'requirements.txt')
+        command = ("source " + os.path.join(venv, 'bin/activate')
+                   + " && pip install" + (" -U" if update else ""))
+        if use_wheelhouse:
+            remote_wheelhouse = posixpath.join(self.REMOTE_WHEELHOUSE_DIR,
+                                               requirements_hash)
+            command += " --no-index --find-links " + remote_wheelhouse
+            # Wheelhouses of other requirements files are no longer needed
+            command = ("find %s -mindepth 1 -maxdepth 1 ! -name %s"
+                       " -exec rm -rf {} + && %s"
+                       % (self.REMOTE_WHEELHOUSE_DIR, requirements_hash,
+                          command))
+        return (command + " -r " + requirements + " && echo %s > %s"
+                % (requirements_hash,
+                   posixpath.join(venv, self.REQUIREMENTS_MARKER)))
+
+    @timed
+    def install_virtualenv(self, update=False, force=False):
+        """Install or updates the virtualenv according to the requirements file.
+        Nothing is done if the virtualenv was installed from the same
+        requirements file, unless force is True.
+        """
+        state = self.probe()
 
-        if not exists(venv):
+        if not state['venv']:
             puts(colors.red('Cannot find virtualenv. Run setup_virtualenv '
                             'first!'))
             return
 
-        if not exists(requirements):
+        requirements_hash = state['requirements']
+        if not requirements_hash:
             puts(colors.red('Cannot find requirements file.'))
             return
 
-        run("source " + activate + " && pip install" + (" -U" if update else "")
-            + " -r " + requirements)
+        if state['venv_requirements'] == requirements_hash and not force:
+            puts(colors.green('Virtualenv is up to date with the requirements'
+                              ' file.'))
+            return
 
+        use_wheelhouse = self.WHEELHOUSE is not None
+        if (self.WHEELHOUSE == 'local'
+                and self._local_requirements_hash() != requirements_hash):
+            puts(colors.yellow('The local requirements file differs from the'
+                               ' remote one. Not using the wheelhouse.'))
+            use_wheelhouse = False
+
+        if use_wheelhouse:
+            local_wheelhouse = self.build_wheelhouse(requirements_hash)
+            if requirements_hash not in state['wheelhouses']:
+                remote_wheelhouse = posixpath.join(self.REMOTE_WHEELHOUSE_DIR,
+                                                   requirements_hash)
+                run('mkdir -p ' + remote_wheelhouse)
+                put(os.path.join(local_wheelhouse, '*.whl'), remote_wheelhouse)
+
+        run(self._pip_install_command(requirements_hash, update,
+                                      use_wheelhouse))
+        state['venv_requirements'] = requirements_hash
+
+    @timed
     def git_pull(self):
         """Calls git pull on the remote host, taking care for not doing
         anything wrong with the repository.
+
+        The state of the repository is probed first, and the checkout and pull
+        are sent together in a single command. With the 'bundle'
+        GIT_DISTRIBUTION, the commits the host is missing are uploaded in a
+        bundle and fetched from it instead of from origin.
         """
 
         repo = self._get_repository_dir()
+        state = self.probe()
+
+        if not state['repo']:
+            abort(colors.red('Cannot find the remote repository. Run'
+                             ' setup_repository first!'))
 
         # Check if there are uncommited changes to the remote repository
+        if state['dirty']:
+            abort(colors.red('There are uncommited changes in the'
+                             ' remote repository. Will not continue.'))
+
+        commands = []
+
+        bundle = self.GIT_DISTRIBUTION == 'bundle'
+        if bundle:
+            if (state['branch'] == self.GIT_BRANCH
+                    and state['head'] == self._local_head()):
+                puts(colors.green('Already up to date'))
+                return
+            # Fetch the missing commits from a bundle, as if from origin
+            local_bundle = self.build_bundle(state['head'])
+            remote_bundle = '~/' + os.path.basename(local_bundle)
+            put(local_bundle, remote_bundle)
+            commands.append('git fetch -q %(bundle)s +refs/heads/%(branch)s:'
+                            'refs/remotes/origin/%(branch)s'
+                            ' && rm -f %(bundle)s'
+                            % {'bundle': remote_bundle,
+                               'branch': self.GIT_BRANCH})
+
+        # Checkout the correct branch, if needed. If the checkout fails, the
+        # branches are updated (unless they were just fetched from the bundle)
+        # and the checkout is tried again.
+        if state['branch'] != self.GIT_BRANCH:
+            puts(colors.yellow('Repository should be on branch %s but is on'
+                               ' %s. Correcting.'
+                               % (self.GIT_BRANCH, state['branch'])))
+            commands.append('{ git checkout %(branch)s || {'
+                            ' %(update)sgit checkout'
+                            ' -b %(branch)s origin/%(branch)s; }; }'
+                            % {'branch': self.GIT_BRANCH,
+                               'update': '' if bundle
+                                         else 'git remote update && '})
+
+        # Pull our branch
+        puts(colors.green('Pulling changes'))
+        if bundle:
+            commands.append('git merge -q --ff-only origin/' + self.GIT_BRANCH)
+        else:
+            commands.append('git pull --ff-only origin %s:%s'
+                            % (self.GIT_BRANCH, self.GIT_BRANCH))
         with cd(repo):
-            with settings(
-                    hide('warnings', 'running', 'stdout', 'stderr'),
-                    warn_only=True):
-                # Refresh the status of the index
-                run('git update-index -q --ignore-submodules --refresh')
-                diff_files = run('git diff-files --quiet --ignore-submodules')
-                diff_index = run('git diff-index --cached --quiet'
-                                 '  HEAD --ignore-submodules --')
-
-                if diff_files.failed or diff_index.failed:
-                    abort(colors.red('There are uncommited changes in the'
-                                     ' remote repository. Will not continue.'))
-
-            # Certify that we are in the correct branch
-            with settings(
-                    hide('warnings', 'running', 'stdout', 'stderr'),
-                    warn_only=True):
-                curr_branch = run('git symbolic-ref HEAD')
-                # Strip the name of the branch, if any
-                if curr_branch.failed:
-                    curr_branch = "(none)"
-                elif curr_branch.startswith('refs/heads/'):
-                    curr_branch = curr_branch[11:]
-
-            # Checkout the correct branch, if needed
-            if curr_branch != self.GIT_BRANCH:
-                puts(colors.yellow('Repository should be on branch %s but is on'
-                                   ' %s. Correcting.'
-                                   % (self.GIT_BRANCH, curr_branch)))
-                with settings(hide('warnings'), warn_only=True):
-                    result = run('git checkout ' + self.GIT_BRANCH)
-                if result.failed:
-                    puts(colors.yellow('Checkout failed. Trying to update'
-                                       ' branches'))
-                    run('git remote update')
-                    run('git checkout -b %s origin/%s'
-                        % (self.GIT_BRANCH, self.GIT_BRANCH))
-
-            # Pull our branch
-            puts(colors.green('Pulling changes'))
-            run('git pull --ff-only origin %s:%s'
-                % (self.GIT_BRANCH, self.GIT_BRANCH))
+            run(' && '.join(commands))
+        self.forget_probe()
 
+    @timed
     def git_push(self):
         """Push the changes in the local repository to the central repository,
         if needed.
@@ -264,14 +609,53 @@ class BasicTarget(object):
         local('git push %(remote)s %(branch)s:%(branch)s'
                % {'remote': self.GIT_REMOTE, 'branch': self.GIT_BRANCH})
 
+    @timed
     def restart_app(self):
         """Restart the application server by updating the modification time of
-        the wsgi.py file.
+        the wsgi.py file. The deploy version is recorded first, so that pages
+        cached by the previous deploy are no longer used.
         """
         wsgi_file = os.path.join(self._get_siteconfig_dir(), 'wsgi.py')
+        version_file = os.path.join(self._get_siteconfig_dir(),
+                                    'deploy_version.txt')
         puts(colors.green("Restarting Application Server"))
-        run("touch " + wsgi_file)
+        run("echo %s > %s && touch %s"
+            % (self.deploy_version, version_file, wsgi_file))
 
+    def get_restart_batches(self, hosts):
+        """Splits the given hosts into the batches of a rolling restart,
+        according to RESTART_BATCH_SIZE.
+        """
+        size = self.RESTART_BATCH_SIZE
+        if isinstance(size, basestring) and size.endswith('%'):
+            size = int(math.ceil(len(hosts) * float(size[:-1]) / 100))
+        size = max(int(size), 1)
+        return [hosts[i:i + size] for i in range(0, len(hosts), size)]
+
+    def wait_until_ready(self, host_string):
+        """Polls the READINESS_URL of the given host until it answers 200
+        within READINESS_LATENCY seconds. Returns None when it does, or the
+        reason it was not ready after READINESS_TIMEOUT seconds.
+        """
+        url = self.READINESS_URL % {'host': normalize(host_string)[1]}
+        deadline = time.time() + self.READINESS_TIMEOUT
+        while True:
+            start = time.time()
+            try:
+                response = urllib2.urlopen(url, timeout=self.READINESS_TIMEOUT)
+                response.read()
+                latency = time.time() - start
+                if latency <= self.READINESS_LATENCY:
+                    return None
+                reason = '%s answered in %.2f seconds' % (url, latency)
+            except (urllib2.URLError, IOError) as e:
+                reason = '%s failed: %s' % (url, e)
+
+            if time.time() >= deadline:
+                return reason
+            time.sleep(1)
+
+    @timed
     def run_django_manage(self, arguments):
         """Execute a manage.py command. The arguments parameter should be the
         arguments for the manage.py command.
@@ -281,28 +665,76 @@ class BasicTarget(object):
         activate = os.path.join(venv, 'bin/activate')
 
         with prefix("source " + activate):
-            with cd(self._get_repository_dir()):
+            with cd(self._get_project_dir()):
                 run("export DJANGO_DEPLOY_ENV='" + self.DJANGO_DEPLOY_ENV +
                     "' && ./manage.py " + arguments)
 
+    def run_django_manage_batch(self, commands):
+        """Execute many manage.py commands, given as a list of arguments, one
+        after another in a single Django process (manage.py batch). Stops at the
+        first command that fails.
+        """
+        if len(commands) == 1:
+            return self.run_django_manage(commands[0])
+        self.run_django_manage("batch " + " ".join(quote(c) for c in commands))
+
+    def get_migration_host(self):
+        """Returns the host on which the database migrations are run.
+        """
+        if self.MIGRATION_HOST:
+            return self.MIGRATION_HOST
+        hosts = env.roledefs.get('db') or self.DB_SERVERS
+        if not hosts:
+            abort('The deploy target has no database host.')
+        return hosts[0]
+
+    @timed
     def db_migrate(self, do_syncdb=False, do_fake=False):
-        """Execute syncdb and migrate for the database.
+        """Execute syncdb and migrate for the database, in a single process,
+        if anything is pending (see get_migrate_command()).
         """
-        if do_syncdb:
-            if do_fake:
-                self.run_django_manage("syncdb --all")
-            else:
-                self.run_django_manage("syncdb")
+        self.run_django_manage(self.get_migrate_command(do_syncdb, do_fake))
 
+    def get_migrate_command(self, do_syncdb=False, do_fake=False):
+        """Returns the manage.py command of db_migrate(). syncdb is run whenever
+        tables are missing; with do_fake, the migrations are marked as applied
+        without running them, and with do_syncdb too, syncdb creates the tables
+        of the migrated apps as well.
+        """
+        command = "dbupdate"
         if do_fake:
-            self.run_django_manage("migrate --fake")
-        else:
-            self.run_django_manage("migrate")
+            command += " --fake"
+            if do_syncdb:
+                command += " --all"
+        return command
 
+    @timed
     def db_collectstatic(self):
-        """Install static files.
+        """Install static files. With HASHED_STATIC, only the files that changed
+        since the last deploy are copied.
         """
-        self.run_django_manage("collectstatic --noinput -v 0")
+        if self.HASHED_STATIC:
+            self.run_django_manage("collecthashed -v 0")
+        else:
+            self.run_django_manage("collectstatic --noinput -v 0")
+
+    def prepare_release(self):
+        """Prepare the pulled code to be run. The repository is run in place,
+        so there is nothing to do.
+        """
+        pass
+
+    def activate_release(self):
+        """Make the prepared code the one being run. The repository is run in
+        place, so there is nothing to do.
+        """
+        pass
+
+    def rollback_release(self):
+        """Go back to the code run before the last deploy.
+        """
+        abort('Deploy target %s runs the repository in place and cannot be'
+              ' rolled back. Use a ReleaseTarget.' % self.__class__.__name__)
 
 class SimpleTarget(BasicTarget):
     """Simple target for small deploys. Everything is on the same host, and the
@@ -339,6 +771,154 @@ class SimpleTarget(BasicTarget):
         return os.path.join(self.HTDOCS_DIR, 'static')
 
 
+class ReleaseTarget(SimpleTarget):
+    """Simple target deploying releases instead of pulling into the running
+    code.
+
+    The repository in PROJECT_DIR/repo is only used to fetch the code. Each
+    deploy exports its HEAD to PROJECT_DIR/releases/<sha>, compiles it and
+    collects its static files, and then points the PROJECT_DIR/current symlink
+    to it, which the application server must run from. The switch is atomic,
+    so no worker ever sees half updated code, and rolling back is switching the
+    symlink back. Files that must outlive releases (the SQLite databases, the
+    cache, the secret key...) are kept in PROJECT_DIR/shared and linked into
+    each release.
+    """
+
+    PROJECT_DIR    = '~/app'
+    KEEP_RELEASES  = 5 # Number of releases kept, including the current one
+
+    # Paths of each release linked to PROJECT_DIR/shared
+    SHARED_DIRS    = ('siteconfig/db', 'siteconfig/cache', 'siteconfig/media')
+    SHARED_FILES   = ('siteconfig/deploy_envs/local_site_key.txt',)
+
+    def _get_repository_dir(self):
+        return os.path.join(self.PROJECT_DIR, 'repo')
+
+    def _get_releases_dir(self):
+        return os.path.join(self.PROJECT_DIR, 'releases')
+
+    def _get_shared_dir(self):
+        return os.path.join(self.PROJECT_DIR, 'shared')
+
+    def _get_project_dir(self):
+        return os.path.join(self.PROJECT_DIR, 'current')
+
+    def _get_siteconfig_dir(self):
+        return os.path.join(self._get_project_dir(), 'siteconfig')
+
+    def _get_previous_link(self):
+        return os.path.join(self.PROJECT_DIR, 'previous')
+
+    def _get_history_file(self):
+        return os.path.join(self.PROJECT_DIR, 'history')
+
+    def _switch_command(self, release):
+        """Returns the command pointing the current symlink to the release in
+        the shell variable of the given name. The release current until then is
+        recorded in the previous symlink, which rollback_release() switches
+        back to, and the release is appended to the history file, which
+        activate_release() prunes by. Both symlinks are replaced by renaming a
+        new symlink over them, so they are never missing.
+        """
+        return ('old=$(readlink %(current)s 2>/dev/null || true)'
+                ' && { test -z "$old"'
+                ' || test "$(basename $old)" = "$%(release)s"'
+                ' || { ln -sfn $old %(previous)s.tmp'
+                ' && mv -Tf %(previous)s.tmp %(previous)s; }; }'
+                ' && ln -sfn %(releases)s/$%(release)s %(current)s.tmp'
+                ' && mv -Tf %(current)s.tmp %(current)s'
+                ' && echo $%(release)s >> %(history)s'
+                % {'releases': self._get_releases_dir(), 'release': release,
+                   'current': self._get_project_dir(),
+                   'previous': self._get_previous_link(),
+                   'history': self._get_history_file()})
+
+    def _prune_command(self):
+        """Returns the command removing the releases other than the last
+        KEEP_RELEASES made current, according to the history file, and the
+        previous release.
+        """
+        return ('cd %(releases)s'
+                ' && keep=" $(tac %(history)s | awk \'!seen[$0]++\''
+                ' | head -n %(keep)d | tr \'\\n\' \' \')'
+                '$(basename "$(readlink %(previous)s 2>/dev/null)") "'
+                ' && for release in *; do case "$keep" in'
+                ' *" $release "*) ;; *) rm -rf "$release" ;; esac; done'
+                % {'releases': self._get_releases_dir(),
+                   'history': self._get_history_file(),
+                   'previous': self._get_previous_link(),
+                   'keep': self.KEEP_RELEASES})
+
+    @timed
+    def prepare_release(self):
+        """Export the HEAD of the repository to a new release, unless it was
+        already prepared, link the shared files into it, compile its modules
+        and, on static hosts, collect its static files. A release that fails to
+        be prepared is removed, and prepared again by the next deploy.
+        """
+        shared = self._get_shared_dir()
+        python = os.path.join(self._get_virtualenv_dir(), 'bin/python')
+
+        commands = [
+            'rm -rf $release',
+            'mkdir -p $release',
+            'git archive HEAD | tar -x -C $release',
+        ]
+        for path in self.SHARED_DIRS:
+            commands.append('mkdir -p %(shared)s/%(path)s'
+                            ' && rm -rf $release/%(path)s'
+                            ' && ln -s %(shared)s/%(path)s $release/%(path)s'
+                            % {'shared': shared, 'path': path})
+        for path in self.SHARED_FILES:
+            commands.append('mkdir -p $(dirname %(shared)s/%(path)s)'
+                            ' && ln -sf %(shared)s/%(path)s $release/%(path)s'
+                            % {'shared': shared, 'path': path})
+        commands.append('%s -m compileall -q $release' % python)
+        if env.host_string in self._get_static_servers():
+            commands.append("(cd $release && DJANGO_DEPLOY_ENV='%s' %s"
+                            " manage.py %s -v 0)"
+                            % (self.DJANGO_DEPLOY_ENV, python,
+                               'collecthashed' if self.HASHED_STATIC
+                               else 'collectstatic --noinput'))
+        commands.append('touch $release/.prepared')
+
+        puts(colors.green('Preparing release'))
+        with cd(self._get_repository_dir()):
+            run('release=%s/$(git rev-parse HEAD)'
+                ' && { test -f $release/.prepared'
+                ' || { %s; } || { rm -rf $release; false; }; }'
+                % (self._get_releases_dir(), ' && '.join(commands)))
+
+    @timed
+    def activate_release(self):
+        """Point the current symlink to the release of the HEAD of the
+        repository, and remove the releases beyond KEEP_RELEASES.
+        """
+        releases = self._get_releases_dir()
+        puts(colors.green('Switching to the new release'))
+        with cd(self._get_repository_dir()):
+            run('sha=$(git rev-parse HEAD) && test -f %s/$sha/.prepared'
+                ' && %s && %s'
+                % (releases, self._switch_command('sha'),
+                   self._prune_command()))
+
+    @timed
+    def rollback_release(self):
+        """Point the current symlink back to the release recorded as previous
+        when it was switched to. Rolling back twice goes back to the same
+        release.
+        """
+        puts(colors.yellow('Rolling back to the previous release'))
+        with settings(hide('warnings'), warn_only=True):
+            result = run('previous=$(basename "$(readlink %s 2>/dev/null)")'
+                         ' && test -f %s/$previous/.prepared && %s'
+                         % (self._get_previous_link(),
+                            self._get_releases_dir(),
+                            self._switch_command('previous')))
+        if result.failed:
+            abort('There is no release to roll back to.')
+
 # Fill in the list of known targets
 import deploy_targets
 import inspect
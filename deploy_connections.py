@@ -0,0 +1,87 @@
+"""SSH connections of the deploy targets.
+
+Fabric opens the SSH connection to a host when the first task reaches it, and
+keeps it in its connection cache for the rest of the session; every command
+then runs in a new channel of that connection. warm_up() opens the connections
+to all the hosts of a deploy target at the same time instead, so that the
+handshakes of the hosts overlap, and install_reconnecting_cache() makes the
+cache replace the connections that died (e.g. while waiting for a long local
+step) instead of failing the next command. The connections send keepalives
+every env.keepalive seconds, see BasicTarget.SSH_KEEPALIVE.
+
+In parallel mode, Fabric runs each host in a new process, which drops the
+connection it inherited (an SSH connection can't be shared between processes)
+and opens its own, so warming up the connections would be wasted.
+"""
+
+from fabric import operations, sftp, state
+from fabric.api import env, settings, hide
+from fabric.network import HostConnectionCache, connect, normalize, \
+    normalize_to_string
+import threading
+import time
+
+import deploy_timing
+
+
+class ReconnectingConnectionCache(HostConnectionCache):
+    """Fabric's connection cache, connecting again to the hosts whose
+    connection is no longer active.
+    """
+
+    def __getitem__(self, key):
+        key = normalize_to_string(key)
+        if dict.__contains__(self, key):
+            client = dict.__getitem__(self, key)
+            transport = client.get_transport()
+            if transport is None or not transport.is_active():
+                client.close()
+                self.connect(key)
+        return HostConnectionCache.__getitem__(self, key)
+
+def install_reconnecting_cache():
+    """Makes Fabric use a connection cache reconnecting the dead connections.
+    To be called before connecting to any host.
+    """
+    if isinstance(state.connections, ReconnectingConnectionCache):
+        return
+    cache = ReconnectingConnectionCache()
+    cache.update(state.connections)
+    # fabric.operations and fabric.sftp imported the cache object itself
+    state.connections = operations.connections = sftp.connections = cache
+
+def warm_up(hosts):
+    """Opens the connections to the given hosts at the same time, and adds them
+    to Fabric's cache. Returns a dict of the hosts that could not be connected
+    to, to the errors. They are connected to again when first used, and then
+    the user can answer the prompts for passwords.
+    """
+    # The cache is keyed by "user@host:port"
+    keys = dict((normalize_to_string(h), h) for h in hosts)
+    keys = dict((key, host_string) for key, host_string in keys.items()
+                if not dict.__contains__(state.connections, key))
+    failures = {}
+
+    def worker(key, host_string):
+        user, host, port = normalize(key)
+        start = time.time()
+        try:
+            client = connect(user, host, port)
+        except BaseException as e:
+            # Including the SystemExit of the prompts
+            failures[host_string] = e
+        else:
+            dict.__setitem__(state.connections, key, client)
+        deploy_timing.record(host_string, 'ssh_warm_up', time.time() - start,
+                             failed=host_string in failures)
+
+    # The threads can't prompt for passwords or host keys
+    with settings(hide('aborts', 'warnings'), abort_on_prompts=True):
+        threads = [threading.Thread(target=worker, args=item)
+                   for item in keys.items()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return failures
@@ -0,0 +1,154 @@
+"""Timing of the deploy routines.
+
+The routines of the deploy targets decorated with timed() record the time they
+take on each host, the number of remote commands they run, and the bytes those
+commands and the file transfers send and receive. Only the outermost routine is
+recorded when routines call each other.
+
+The deploy routines use the run(), put() and get() of this module, which count
+what Fabric sends over SSH: the commands and their output, and the files.
+"""
+
+from fabric.api import env, run as _run, put as _put, get as _get
+from fabric import colors
+from glob import glob
+import functools
+import json
+import os
+import time
+
+# Records of this process, see pop_records()
+_records = []
+
+# What was sent and received so far
+_counters = {'execs': 0, 'bytes_out': 0, 'bytes_in': 0}
+
+# Number of timed routines being run
+_depth = [0]
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def run(command, *args, **kwargs):
+    """Fabric's run(), counted.
+    """
+    _counters['execs'] += 1
+    _counters['bytes_out'] += len(command)
+    result = _run(command, *args, **kwargs)
+    _counters['bytes_in'] += len(result) + len(getattr(result, 'stderr', ''))
+    return result
+
+def put(local_path, *args, **kwargs):
+    """Fabric's put(), counted.
+    """
+    result = _put(local_path, *args, **kwargs)
+    if isinstance(local_path, basestring):
+        paths = glob(os.path.expanduser(local_path))
+        _counters['bytes_out'] += sum(_file_size(p) for p in paths)
+    return result
+
+def get(*args, **kwargs):
+    """Fabric's get(), counted.
+    """
+    result = _get(*args, **kwargs)
+    _counters['bytes_in'] += sum(_file_size(p) for p in result)
+    return result
+
+def record(host, step, seconds, failed=False, execs=0, bytes_out=0,
+           bytes_in=0):
+    """Records a step that took the given time on the given host.
+    """
+    _records.append({
+        'host': host,
+        'step': step,
+        'seconds': seconds,
+        'failed': failed,
+        'execs': execs,
+        'bytes_out': bytes_out,
+        'bytes_in': bytes_in,
+    })
+
+def timed(method):
+    """Decorator recording the calls to a routine of a deploy target.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _depth[0]:
+            return method(*args, **kwargs)
+
+        before = dict(_counters)
+        start = time.time()
+        failed = True
+        _depth[0] += 1
+        try:
+            result = method(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _depth[0] -= 1
+            record(env.host_string or 'local', method.__name__,
+                   time.time() - start, failed,
+                   **dict((k, _counters[k] - before[k]) for k in _counters))
+    return wrapper
+
+def pop_records():
+    """Returns the records of this process and forgets them. The tasks run in
+    parallel return them to the parent process, which adds them to its own
+    with add_records().
+    """
+    records = list(_records)
+    del _records[:]
+    return records
+
+def add_records(records):
+    _records.extend(records)
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return '%d %s' % (count, unit)
+        count /= 1024.0
+    return '%.1f GB' % count
+
+def print_summary(records, seconds):
+    """Prints the time taken by each step on each host, slowest first, and
+    the totals of each host.
+    """
+    print colors.green('Deploy timings (%.1f seconds in total):' % seconds,
+                       bold=True)
+    print '    %-24s %-30s %9s %6s %10s %10s' % ('step', 'host', 'seconds',
+                                                 'execs', 'sent', 'received')
+    for r in sorted(records, key=lambda r: r['seconds'], reverse=True):
+        line = '    %-24s %-30s %9.2f %6d %10s %10s' % (
+            r['step'], r['host'], r['seconds'], r['execs'],
+            _format_bytes(r['bytes_out']), _format_bytes(r['bytes_in']))
+        print colors.red(line) if r['failed'] else line
+
+    hosts = {}
+    for r in records:
+        totals = hosts.setdefault(r['host'], [0, 0])
+        totals[0] += r['seconds']
+        totals[1] += r['execs']
+    print '    %-24s %-30s %9s %6s' % ('', 'host total', 'seconds', 'execs')
+    for host, (host_seconds, execs) in sorted(hosts.items()):
+        print '    %-24s %-30s %9.2f %6d' % ('', host, host_seconds, execs)
+
+def write_report(task_name, records, started, seconds, report_dir):
+    """Writes the records of a task to a JSON file in the given directory, and
+    returns its path.
+    """
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+    path = os.path.join(report_dir, '%s-%s.json' % (
+        task_name, time.strftime('%Y%m%d%H%M%S', time.localtime(started))))
+    with open(path, 'w') as f:
+        json.dump({
+            'task': task_name,
+            'started': started,
+            'seconds': seconds,
+            'steps': records,
+        }, f, indent=1, sort_keys=True)
+    return path
@@ -1,11 +1,16 @@
 import os
+import time
 import deploy as deploy_conf
+import deploy_connections
+import deploy_timing
 
-from fabric.api import env, task, roles, run, execute, sudo
+from fabric.api import env, task, roles, run, execute, sudo, settings
 from fabric import colors
 from fabric.utils import abort
 
 import inspect
+from contextlib import contextmanager
+from functools import wraps
 
 ################################################################################
 # Tasks for managing Deploy Targets
@@ -21,10 +26,21 @@ def target(target_name):
     target = target_class()
     env['deploy_target'] = target
     env.roledefs.update(target.get_roles())
+    env.parallel = target.PARALLEL
+    env.pool_size = target.POOL_SIZE
+    if not env.keepalive:
+        env.keepalive = target.SSH_KEEPALIVE
 
     print (colors.green("Selected deploy target ")
             + colors.green(target_name, bold=True))
 
+    deploy_connections.install_reconnecting_cache()
+    if target.SSH_WARM_UP and not target.PARALLEL:
+        failures = deploy_connections.warm_up(target.get_hosts())
+        for host, error in sorted(failures.items()):
+            print '    %s: %s (will connect again when needed)' % (
+                colors.yellow(host), _describe_failure(error))
+
 @task
 def list_targets():
     """List all the available targets
@@ -35,12 +51,137 @@ def list_targets():
     print 'Available targets:'
     print '\n'.join(targets)
 
+################################################################################
+# Parallel execution of role tasks
+################################################################################
+def _describe_failure(error):
+    """Returns a short description of the exception raised by a task on a
+    host.
+    """
+    if isinstance(error, SystemExit):
+        return 'aborted (see the output of the host above)'
+    return '%s: %s' % (error.__class__.__name__, error)
+
+def _returns_timings(func):
+    """Decorator making a role task return the timings recorded while it ran,
+    so that they reach the parent process when it runs in parallel. They are
+    added back to the records by _add_timings().
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        func(*args, **kwargs)
+        return deploy_timing.pop_records()
+    return wrapper
+
+def _add_timings(results):
+    for result in results.itervalues():
+        if isinstance(result, list):
+            deploy_timing.add_records(result)
+
+@contextmanager
+def _timing_report(task_name):
+    """Prints the timings of the routines run by a main task when it ends, and
+    writes them to the TIMING_REPORT_DIR of the deploy target.
+    """
+    started = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - started
+        records = deploy_timing.pop_records()
+        deploy_timing.print_summary(records, seconds)
+        report_dir = env.deploy_target.TIMING_REPORT_DIR
+        if report_dir:
+            path = deploy_timing.write_report(task_name, records, started,
+                                              seconds, report_dir)
+            print 'Timing report written to %s' % path
+
+def _execute(task, *args, **kwargs):
+    """Executes a role task on all the hosts of its roles.
+
+    If the deploy target is in parallel mode, the hosts of each role are worked
+    on at the same time, at most get_pool_size(role) of them at once, and a
+    host which belongs to many roles is visited only once. The failures of all
+    the hosts are collected and reported together at the end. Otherwise, this is
+    the same as execute().
+    """
+    target = env.deploy_target
+    if not target.PARALLEL:
+        results = execute(task, *args, **kwargs)
+        _add_timings(results)
+        return results
+
+    results = {}
+    for role in getattr(task, 'roles', []):
+        hosts = [h for h in env.roledefs.get(role, []) if h not in results]
+        if not hosts:
+            continue
+        with settings(parallel=True, pool_size=target.get_pool_size(role)):
+            results.update(execute(task, hosts=hosts, *args, **kwargs))
+
+    _add_timings(results)
+    _check_results(task, results)
+    return results
+
+def _check_results(task, results):
+    """Reports the hosts on which a task executed in parallel failed, if any,
+    and aborts.
+    """
+    failures = sorted((host, result) for host, result in results.iteritems()
+                      if isinstance(result, BaseException))
+    if failures:
+        print colors.red('%d of %d hosts failed:' % (len(failures),
+                                                     len(results)), bold=True)
+        for host, error in failures:
+            print '    %s: %s' % (colors.red(host), _describe_failure(error))
+        abort('Task "%s" failed on %d host(s).' % (task.name, len(failures)))
+
+def _restart_app(rolling=None):
+    """Restarts the application servers, all at once or, if the deploy target
+    asks for it, in rolling batches: each batch is restarted, then every host of
+    the batch must pass the readiness check before the next batch starts. The
+    restart stops at the first batch that fails.
+    """
+    target = env.deploy_target
+    if rolling is None:
+        rolling = target.ROLLING_RESTART
+    if not rolling:
+        return _execute(restart_app)
+
+    batches = target.get_restart_batches(env.roledefs.get('app', []))
+    for number, batch in enumerate(batches, 1):
+        print colors.green('Restarting batch %d of %d: %s'
+                           % (number, len(batches), ', '.join(batch)))
+        with settings(parallel=target.PARALLEL,
+                      pool_size=target.get_pool_size('app')):
+            results = execute(restart_app, hosts=batch)
+        _add_timings(results)
+        if target.PARALLEL:
+            _check_results(restart_app, results)
+
+        failures = []
+        for host in batch:
+            start = time.time()
+            reason = target.wait_until_ready(host)
+            deploy_timing.record(host, 'wait_until_ready', time.time() - start,
+                                 failed=bool(reason))
+            if reason:
+                failures.append((host, reason))
+        if failures:
+            for host, reason in failures:
+                print '    %s: %s' % (colors.red(host), reason)
+            abort('Batch %d of %d is not ready. The %d hosts of the next'
+                  ' batches were not restarted.'
+                  % (number, len(batches),
+                     sum(len(b) for b in batches[number:])))
+
 ################################################################################
 # Auxiliary tasks
 ################################################################################
 
 @task()
 @roles('app', 'db', 'static')
+@_returns_timings
 def git_pull():
     """Pull changes to the repository of all remote hosts.
     """
@@ -48,6 +189,7 @@ def git_pull():
 
 @task
 @roles('app', 'db', 'static')
+@_returns_timings
 def setup_repository(force=False):
     """Clone the remote repository, creating the SSH keys if necessary.
     """
@@ -55,6 +197,7 @@ def setup_repository(force=False):
 
 @task
 @roles('app', 'db', 'static')
+@_returns_timings
 def setup_virtualenv(force=False):
     """Create the virtualenv and install the packages from the requirements
     file.
@@ -64,10 +207,12 @@ def setup_virtualenv(force=False):
 
 @task
 @roles('app', 'db', 'static')
-def update_virtualenv():
-    """Update the virtualenv according to the requirements file.
+@_returns_timings
+def update_virtualenv(force=False):
+    """Update the virtualenv according to the requirements file, if it changed
+    since the last install or force is given.
     """
-    env.deploy_target.install_virtualenv(update=True)
+    env.deploy_target.install_virtualenv(update=True, force=force)
 
 ################################################################################
 # Main Tasks
@@ -75,33 +220,99 @@ def update_virtualenv():
 
 @task
 @roles('app')
+@_returns_timings
 def restart_app():
     """Restart the application server.
     """
     env.deploy_target.restart_app()
 
+@task
+@roles('app')
+def memory_report(match='wsgi'):
+    """Report the shared and private memory of the application server
+    processes.
+    """
+    env.deploy_target.run_django_manage("memreport --match='%s'" % match)
+
+@task
+@roles('app', 'db', 'static')
+@_returns_timings
+def prepare_release():
+    """Prepare a release of the pulled code, for targets deploying releases.
+    """
+    env.deploy_target.prepare_release()
+
+@task
+@roles('app', 'db', 'static')
+@_returns_timings
+def activate_release():
+    """Switch to the prepared release, for targets deploying releases.
+    """
+    env.deploy_target.activate_release()
+
+@task
+@roles('app', 'db', 'static')
+@_returns_timings
+def rollback_release():
+    """Switch back to the previous release, for targets deploying releases.
+    """
+    env.deploy_target.rollback_release()
+
 @task()
 def deploy():
     """Deploy the application to the selected deploy target.
     """
-    # Push local changes to central repository
-    env.deploy_target.git_push()
+    with _timing_report('deploy'):
+        # Push local changes to central repository
+        env.deploy_target.git_push()
+
+        # Pull changes on remote repositories
+        _execute(git_pull)
+
+        # Prepare the new release on every host before switching any of them
+        _execute(prepare_release)
+        _execute(activate_release)
 
-    # Pull changes on remote repositories
-    execute(git_pull)
+        # Migrate the database, if needed
+        migrate()
 
-    # Restart application server
-    execute(restart_app)
+        # Restart application server
+        _restart_app()
+
+@task()
+def rolling_restart():
+    """Restart the application servers in batches, waiting for each batch to
+    be ready before restarting the next one.
+    """
+    with _timing_report('rolling_restart'):
+        _restart_app(rolling=True)
+
+@task()
+def rollback():
+    """Go back to the previous release of the selected deploy target.
+    """
+    with _timing_report('rollback'):
+        _execute(rollback_release)
+
+        # Restart application server
+        _restart_app()
+
+@_returns_timings
+def _migrate(syncdb, fake):
+    env.deploy_target.db_migrate(syncdb, fake)
 
 @task
-@roles('db')
 def migrate(syncdb=False, fake=False):
-    """Execute syncdb and migrate in the database hosts.
+    """Execute syncdb and migrate on the migration host, if anything is pending.
     """
-    env.deploy_target.db_migrate(syncdb, fake)
+    host = env.deploy_target.get_migration_host()
+    # A single host: not in parallel, so that a failure aborts right away
+    with settings(parallel=False):
+        _add_timings(execute(_migrate, syncdb, fake, hosts=[host]))
 
 @task
 @roles('static')
+@_returns_timings
 def collectstatic():
     """Execute collectstatic on static file hosts.
     """
@@ -111,44 +322,55 @@ def collectstatic():
 def setup():
     """Initial setup of the remote hosts.
     """
-    # Set up git repository
-    execute(setup_repository)
+    with _timing_report('setup'):
+        # Set up git repository
+        _execute(setup_repository)
+
+        # Set up virtualenv
+        _execute(setup_virtualenv)
 
-    # Set up virtualenv
-    execute(setup_virtualenv)
+        # Prepare and switch to the first release
+        _execute(prepare_release)
+        _execute(activate_release)
 
-    # Sync and Migrate database
-    execute(migrate, True, True)
+        # Sync and Migrate database
+        migrate(True, True)
 
-    # Collect static files
-    execute(collectstatic)
+        # Collect static files
+        _execute(collectstatic)
 
-    # Restart application servers
-    execute(restart_app)
+        # Restart application servers
+        _restart_app()
 
 ################################################################################
 # Tasks for manually executing manage.py commands
 ################################################################################
 @task
 @roles('app')
-def app_manage(arguments):
-    """Execute the given manage.py command in Aplication hosts.
+@_returns_timings
+def app_manage(arguments, *commands):
+    """Execute the given manage.py commands in Aplication hosts, in a single
+    process when there are many.
     """
-    env.deploy_target.run_django_manage(arguments)
+    env.deploy_target.run_django_manage_batch((arguments,) + commands)
 
 @task
 @roles('db')
-def db_manage(arguments):
-    """Execute the given manage.py command in Database hosts.
+@_returns_timings
+def db_manage(arguments, *commands):
+    """Execute the given manage.py commands in Database hosts, in a single
+    process when there are many.
     """
-    env.deploy_target.run_django_manage(arguments)
+    env.deploy_target.run_django_manage_batch((arguments,) + commands)
 
 @task
 @roles('static')
-def static_manage(arguments):
-    """Execute the given manage.py command in Static File hosts.
+@_returns_timings
+def static_manage(arguments, *commands):
+    """Execute the given manage.py commands in Static File hosts, in a single
+    process when there are many.
     """
-    env.deploy_target.run_django_manage(arguments)
+    env.deploy_target.run_django_manage_batch((arguments,) + commands)
 
 ################################################################################
 # Auxiliary tasks for helping with SSH public key authentication
@@ -0,0 +1,15 @@
+"""
+URLconf of the admin and its documentation, mounted at admin/ by siteconfig.urls
+when ADMIN_MODE is 'lazy'. Importing it discovers the admin modules of the
+installed apps and loads admindocs, so that the processes which never serve the
+admin never pay for it.
+"""
+from django.conf.urls.defaults import patterns, include, url
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns('',
+    url(r'^doc/', include('django.contrib.admindocs.urls')),
+    url(r'', include(admin.site.urls)),
+)
@@ -0,0 +1,69 @@
+"""
+Versioned per-view caching.
+
+The cache_versioned_page decorator caches the responses of a view by URL and
+deploy version. The deploy version is written by BasicTarget.restart_app on
+every deploy, so the pages of the previous deploy are never served again.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+_deploy_version = None
+
+def get_deploy_version():
+    """
+    Returns the version of the current deploy, read from DEPLOY_VERSION_FILE
+    the first time. The application server is restarted on every deploy, so
+    it never changes during the life of a process.
+    """
+    global _deploy_version
+    if _deploy_version is None:
+        try:
+            with open(settings.DEPLOY_VERSION_FILE) as f:
+                _deploy_version = f.read().strip()
+        except (AttributeError, IOError):
+            _deploy_version = ''
+    return _deploy_version
+
+_caches = {}
+
+def get_cache_instance(alias):
+    """
+    Returns the cache of the given alias, creating it only once per process so
+    that its local tier and connections are kept between requests.
+    """
+    if alias not in _caches:
+        _caches[alias] = get_cache(alias)
+    return _caches[alias]
+
+def cache_versioned_page(timeout=None, cache_alias='default'):
+    """
+    Decorator that caches the successful GET and HEAD responses of a view by
+    their full URL and the deploy version. Responses that set cookies are not
+    cached, but it is up to the view not to depend on the user or session.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            cache = get_cache_instance(cache_alias)
+            key = 'page:%s:%s' % (get_deploy_version(), hashlib.md5(
+                request.build_absolute_uri()).hexdigest())
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                if callable(getattr(response, 'render', None)):
+                    response = response.render()
+                cache.set(key, response, timeout)
+            return response
+        return wrapper
+    return decorator
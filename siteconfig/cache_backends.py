@@ -0,0 +1,144 @@
+"""
+Tiered cache backend.
+
+TieredCache keeps a small LRU cache in the memory of each process in front of a
+shared cache, such as a file based cache or memcached. Reads that hit the local
+tier never leave the process, and writes go to both tiers. Local entries expire
+after at most LOCAL_TIMEOUT seconds, so changes made by other processes show up
+after that. It is configured like this:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'siteconfig.cache_backends.TieredCache',
+            'LOCATION': 'shared',      # Alias of the shared cache
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000,   # Entries kept in memory by each process
+                'LOCAL_TIMEOUT': 30,   # Seconds entries stay in memory
+            },
+        },
+        'shared': {...},
+    }
+
+This module is kept apart from siteconfig.cache because Django imports it while
+setting up django.core.cache.
+"""
+
+import cPickle as pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+
+_MISSING = object()
+
+
+class LocalLRUCache(object):
+    """
+    Size bounded, thread-safe, in-memory cache that drops the least recently
+    used entries first. Values are pickled so that callers never share them.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is None or item[0] < time.time():
+                return default
+            # Mark as the most recently used
+            self._entries[key] = item
+        return pickle.loads(item[1])
+
+    def set(self, key, value, timeout):
+        item = (time.time() + timeout,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = item
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with a LocalLRUCache in front of the shared cache named by
+    LOCATION.
+    """
+
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        options = params.get('OPTIONS', {})
+        self.local_timeout = int(options.get('LOCAL_TIMEOUT', 30))
+        self.local = LocalLRUCache(self._max_entries)
+        self._shared_alias = location
+        self._shared = None
+
+    @property
+    def shared(self):
+        if self._shared is None:
+            self._shared = get_cache(self._shared_alias)
+        return self._shared
+
+    def _local_timeout(self, timeout):
+        return min(self.local_timeout, timeout or self.default_timeout)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version=version)
+        value = self.local.get(local_key, _MISSING)
+        if value is _MISSING:
+            value = self.shared.get(key, _MISSING, version=version)
+            if value is _MISSING:
+                return default
+            self.local.set(local_key, value, self._local_timeout(None))
+        return value
+
+    def set(self, key, value, timeout=None, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.local.set(self.make_key(key, version=version), value,
+                       self._local_timeout(timeout))
+
+    def add(self, key, value, timeout=None, version=None):
+        if not self.shared.add(key, value, timeout, version=version):
+            return False
+        self.local.set(self.make_key(key, version=version), value,
+                       self._local_timeout(timeout))
+        return True
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_key(key, version=version))
+        self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(self.make_key(key, version=version))
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        if self._shared is not None and hasattr(self._shared, 'close'):
+            self._shared.close(**kwargs)
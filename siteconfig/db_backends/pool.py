@@ -0,0 +1,172 @@
+"""
+Process-local pool of DB-API connections.
+
+The pool keeps the connections it hands out open after they are given back, so
+that the next request does not pay the connection and authentication setup
+again. fill() opens the minimum number of connections up front. Connections
+idle for too long are closed, as long as the pool keeps at least its minimum
+size; this is only checked when a connection is taken from the pool, there is
+no background thread. Each connection may be checked before being handed out
+again.
+"""
+
+import os
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection becomes available in time.
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of connections to a single database.
+
+    The ``connect`` argument is a callable that opens a new connection (it may
+    also be given to get() instead), and ``check`` an optional callable that
+    returns whether an idle connection can still be used. At most ``max_size``
+    connections are open at the same time, and getting a connection waits up to
+    ``timeout`` seconds for one to be given back when all of them are in use.
+    """
+
+    def __init__(self, connect=None, check=None, min_size=0, max_size=10,
+                 max_idle=300, timeout=30):
+        self.connect = connect
+        self.check = check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # Idle connections and the time they were given back, the most recently
+        # used last.
+        self._idle = []
+        # Number of open connections, idle or in use
+        self._size = 0
+        self._pid = os.getpid()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict(self):
+        """
+        Closes the connections that have been idle for too long, keeping at
+        least min_size connections open. Must be called with the lock held.
+        """
+        limit = time.time() - self.max_idle
+        while (self._idle and self._idle[0][1] < limit
+               and self._size > self.min_size):
+            conn, last_used = self._idle.pop(0)
+            self._size -= 1
+            self._close(conn)
+
+    def get(self, connect=None):
+        """
+        Returns a connection from the pool, opening a new one with ``connect``
+        if there are no idle connections. Raises PoolTimeout if the pool is
+        exhausted for too long.
+        """
+        deadline = time.time() + self.timeout
+        while True:
+            with self._cond:
+                if self._pid != os.getpid():
+                    # We have been forked. The connections belong to the parent
+                    # process, so forget them without closing them.
+                    self._reset()
+                self._evict()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout('No database connection available'
+                                          ' after %s seconds' % self.timeout)
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn = self._idle.pop()[0]
+                else:
+                    conn = None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return (connect or self.connect)()
+                except:
+                    self.discard(None)
+                    raise
+
+            if self.check is None or self.check(conn):
+                return conn
+            # Stale connection. Throw it away and try again.
+            self.discard(conn)
+
+    def put(self, conn):
+        """
+        Gives a connection back to the pool.
+        """
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        """
+        Closes a connection taken from the pool instead of giving it back, e.g.
+        because it is broken.
+        """
+        if conn is not None:
+            self._close(conn)
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._size -= 1
+            self._cond.notify()
+
+    def fill(self, connect=None):
+        """
+        Opens connections until the pool has at least min_size of them.
+        """
+        conns = []
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            missing = max(self.min_size - self._size, 0)
+        for i in range(missing):
+            conns.append(self.get(connect))
+        for conn in conns:
+            self.put(conn)
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, last_used in idle:
+            self._close(conn)
+
+    def forget(self):
+        """
+        Forgets every connection without closing them, in a forked process
+        where they belong to the parent.
+        """
+        with self._cond:
+            self._reset()
+
+    def size(self):
+        """
+        Returns the number of open connections, idle or in use.
+        """
+        with self._cond:
+            return self._size
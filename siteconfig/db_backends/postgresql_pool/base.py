@@ -0,0 +1,143 @@
+"""
+PostgreSQL database backend with a process-local connection pool.
+
+This is Django's psycopg2 backend, except that closing the connection at the end
+of a request gives it back to a pool shared by all the threads of the process,
+and the next request takes it from there instead of connecting again. The pool
+is configured by the POOL entry of the database settings:
+
+    'POOL': {
+        'MIN_SIZE': 1,              # Connections opened first, kept when idle
+        'MAX_SIZE': 10,             # Connections open at the same time
+        'MAX_IDLE': 300,            # Seconds before an idle connection closes
+        'TIMEOUT': 30,              # Seconds to wait for a free connection
+        'CHECK_ON_CHECKOUT': True,  # Run "SELECT 1" before reusing connections
+    }
+"""
+
+import threading
+
+from django.db.backends.postgresql_psycopg2.base import *
+from django.db.backends.postgresql_psycopg2 import base as psycopg2_base
+from django.db.backends.postgresql_psycopg2.creation import DatabaseCreation \
+    as Psycopg2DatabaseCreation
+
+from siteconfig.db_backends.pool import ConnectionPool
+
+POOL_DEFAULTS = {
+    'MIN_SIZE': 1,
+    'MAX_SIZE': 10,
+    'MAX_IDLE': 300,
+    'TIMEOUT': 30,
+    'CHECK_ON_CHECKOUT': True,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool_key(settings_dict):
+    return tuple(settings_dict[k] for k in ('NAME', 'USER', 'HOST', 'PORT'))
+
+def _is_usable(conn):
+    """
+    Returns whether the given psycopg2 connection still works.
+    """
+    if conn.closed:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+        conn.rollback()
+    except Database.Error:
+        return False
+    return True
+
+def close_pool(settings_dict):
+    """
+    Closes the idle connections of the pool for the given database settings.
+    """
+    with _pools_lock:
+        pool = _pools.pop(_pool_key(settings_dict), None)
+    if pool is not None:
+        pool.close()
+
+
+class DatabaseCreation(Psycopg2DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # PostgreSQL refuses to drop a database with open connections
+        close_pool(dict(self.connection.settings_dict, NAME=test_database_name))
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name,
+                                                       verbosity)
+
+
+class DatabaseWrapper(psycopg2_base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
+
+    def _get_pool(self):
+        key = _pool_key(self.settings_dict)
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+
+        with _pools_lock:
+            if key not in _pools:
+                options = dict(POOL_DEFAULTS)
+                options.update(self.settings_dict.get('POOL', {}))
+                _pools[key] = ConnectionPool(
+                    check=_is_usable if options['CHECK_ON_CHECKOUT'] else None,
+                    min_size=options['MIN_SIZE'],
+                    max_size=options['MAX_SIZE'],
+                    max_idle=options['MAX_IDLE'],
+                    timeout=options['TIMEOUT'])
+            return _pools[key]
+
+    def close_pool(self):
+        """
+        Closes the idle connections of the pool of this database.
+        """
+        close_pool(self.settings_dict)
+
+    def forget_pool(self):
+        """
+        Forgets the connections of the pool without closing them, see
+        ConnectionPool.forget().
+        """
+        self._get_pool().forget()
+
+    def _connect(self):
+        """
+        Opens and sets up a new connection for the pool, as Django does for an
+        unpooled one.
+        """
+        super(DatabaseWrapper, self)._cursor()
+        conn, self.connection = self.connection, None
+        return conn
+
+    def _cursor(self):
+        if self.connection is None:
+            pool = self._get_pool()
+            # Opens the MIN_SIZE connections the first time
+            pool.fill(self._connect)
+            conn = pool.get(self._connect)
+            # The connection may have been used by another thread with a
+            # different transaction mode.
+            conn.set_isolation_level(self.isolation_level)
+            self.connection = conn
+        return super(DatabaseWrapper, self)._cursor()
+
+    def close(self):
+        self.validate_thread_sharing()
+        if self.connection is None:
+            return
+
+        conn, self.connection = self.connection, None
+        pool = self._get_pool()
+        try:
+            conn.rollback()
+        except Database.Error:
+            pool.discard(conn)
+        else:
+            pool.put(conn)
@@ -0,0 +1,48 @@
+"""
+SQLite database backend tuned for many concurrent workers.
+
+This is Django's sqlite3 backend, except that every new connection is set up
+with the PRAGMAs in the TUNING entry of the database settings. The defaults
+switch to the write-ahead log, so that readers don't block the writer, and
+relax fsyncs to the end of each checkpoint:
+
+    'TUNING': {
+        'JOURNAL_MODE': 'WAL',
+        'SYNCHRONOUS': 'NORMAL',
+        'MMAP_SIZE': 64 * 1024 * 1024,  # Bytes of the file mapped in memory
+        'CACHE_SIZE': -16000,           # Page cache per connection, in KiB
+        'BUSY_TIMEOUT': 5000,           # Milliseconds to wait for a lock
+    }
+
+An option set to None is left at SQLite's default.
+"""
+
+from django.db.backends.sqlite3.base import *
+from django.db.backends.sqlite3 import base as sqlite3_base
+
+TUNING_DEFAULTS = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'MMAP_SIZE': 64 * 1024 * 1024,
+    'CACHE_SIZE': -16000,
+    'BUSY_TIMEOUT': 5000,
+}
+
+def apply_tuning(conn, tuning=None):
+    """
+    Sets up a sqlite3 connection with the given tuning options, falling back
+    to TUNING_DEFAULTS for the missing ones.
+    """
+    options = dict(TUNING_DEFAULTS)
+    options.update(tuning or {})
+    # The busy timeout goes first, since changing the journal mode needs a lock
+    for name in ('BUSY_TIMEOUT', 'JOURNAL_MODE', 'SYNCHRONOUS', 'MMAP_SIZE',
+                 'CACHE_SIZE'):
+        if options[name] is not None:
+            conn.execute('PRAGMA %s = %s' % (name.lower(), options[name]))
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+    def _sqlite_create_connection(self):
+        super(DatabaseWrapper, self)._sqlite_create_connection()
+        apply_tuning(self.connection, self.settings_dict.get('TUNING'))
@@ -0,0 +1,172 @@
+"""
+Compiles the settings of a deploy environment into a frozen snapshot.
+
+The settings of a deploy environment are the ``defaults`` module, overridden by
+the deploy environment module, with the DISABLED_APPS removed from the app,
+middleware, context processor and router lists. Resolving them imports both
+modules, reads the secret key and creates directories, so the result is saved
+to ``_frozen_<env>.py`` in this directory along with the modification times of
+the files it came from. As long as none of these files changes, the snapshot is
+imported instead.
+
+Set DJANGO_SETTINGS_SNAPSHOT=0 in the environment to always resolve the
+settings from their sources.
+"""
+
+import os
+import time
+
+import _helper
+
+# Module name of the snapshot of a deploy environment
+SNAPSHOT_MODULE = '_frozen_%s'
+
+# Lists that lose the entries belonging to DISABLED_APPS
+APP_FILTERED_SETTINGS = (
+    'MIDDLEWARE_CLASSES',
+    'TEMPLATE_CONTEXT_PROCESSORS',
+    'DATABASE_ROUTERS',
+)
+
+# How the settings were loaded the last time, for reporting
+LAST_LOAD = {}
+
+def source_files(deploy_env):
+    """
+    Returns the files the settings of the given deploy environment are computed
+    from. They don't all need to exist.
+    """
+    files = [
+        os.path.abspath(__file__.rstrip('co')),
+        os.path.join(_helper.DEPLOY_ENVS_DIR, '_helper.py'),
+        os.path.join(_helper.DEPLOY_ENVS_DIR, 'defaults.py'),
+        _helper.USER_SECRET_KEY_FILE,
+        _helper.LOCAL_SECRET_KEY_FILE,
+    ]
+    if deploy_env != 'defaults':
+        files.append(os.path.join(_helper.DEPLOY_ENVS_DIR, deploy_env + '.py'))
+    return files
+
+def source_mtimes(deploy_env):
+    """
+    Returns a dictionary with the modification time of every source file of the
+    given deploy environment, None for the missing ones.
+    """
+    mtimes = {}
+    for path in source_files(deploy_env):
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+def _module_settings(module):
+    return dict((k, getattr(module, k)) for k in dir(module) if k == k.upper()
+                and not k.startswith('_'))
+
+def compile_settings(deploy_env):
+    """
+    Resolves the settings of the given deploy environment from its sources and
+    returns them as a dictionary.
+    """
+    import defaults
+
+    resolved = _module_settings(defaults)
+    if deploy_env != 'defaults':
+        module = __import__(deploy_env, globals(), locals(), ['*'])
+        resolved.update(_module_settings(module))
+
+    # Remove disabled apps
+    disabled = tuple(resolved.get('DISABLED_APPS', ()))
+    if disabled:
+        from django.conf import global_settings
+
+        resolved['INSTALLED_APPS'] = [a for a in resolved['INSTALLED_APPS']
+                                      if a not in disabled]
+        for name in APP_FILTERED_SETTINGS:
+            values = resolved.get(name, getattr(global_settings, name))
+            resolved[name] = [v for v in values if not v.startswith(disabled)]
+
+    # Freeze the lists
+    for name, value in resolved.items():
+        if isinstance(value, list):
+            resolved[name] = tuple(value)
+
+    return resolved
+
+def write_snapshot(deploy_env, resolved, mtimes):
+    """
+    Saves the resolved settings of the given deploy environment as an
+    importable module. Returns False if the settings cannot be represented as
+    Python literals or the file cannot be written.
+    """
+    import pprint
+
+    text = pprint.pformat(resolved)
+    try:
+        if eval(text, {}) != resolved:
+            return False
+    except Exception:
+        return False
+
+    path = os.path.join(_helper.DEPLOY_ENVS_DIR,
+                        SNAPSHOT_MODULE % deploy_env + '.py')
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        # The snapshot holds the SECRET_KEY, so keep it private
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            f.write('# Generated by deploy_envs/_compiler.py. Do not edit.\n')
+            f.write('SOURCES = %s\n\n' % pprint.pformat(mtimes))
+            f.write('SETTINGS = %s\n' % text)
+        os.rename(tmp_path, path)
+        # Never let an older bytecode file shadow the new snapshot
+        if os.path.exists(path + 'c'):
+            os.remove(path + 'c')
+    except (IOError, OSError):
+        return False
+    return True
+
+def load_snapshot(deploy_env, mtimes):
+    """
+    Returns the settings saved in the snapshot of the given deploy environment,
+    or None if there is no snapshot or it is out of date.
+    """
+    try:
+        snapshot = __import__(SNAPSHOT_MODULE % deploy_env, globals(), locals(),
+                              ['*'])
+    except (ImportError, SyntaxError):
+        return None
+    if getattr(snapshot, 'SOURCES', None) != mtimes:
+        return None
+    return snapshot.SETTINGS
+
+def load_settings(deploy_env):
+    """
+    Returns the settings of the given deploy environment, from its snapshot if
+    it is up to date, or else resolving them and saving a new snapshot.
+    """
+    start = time.time()
+    use_snapshot = os.environ.get('DJANGO_SETTINGS_SNAPSHOT', '') != '0'
+
+    resolved = None
+    if use_snapshot:
+        mtimes = source_mtimes(deploy_env)
+        resolved = load_snapshot(deploy_env, mtimes)
+    from_snapshot = resolved is not None
+
+    if resolved is None:
+        resolved = compile_settings(deploy_env)
+        if use_snapshot:
+            # Resolving may create missing sources (such as the local secret
+            # key), but must not race with changes to the existing ones.
+            new_mtimes = source_mtimes(deploy_env)
+            if all(mtimes[p] in (None, new_mtimes[p]) for p in mtimes):
+                write_snapshot(deploy_env, resolved, new_mtimes)
+
+    LAST_LOAD.update({
+        'deploy_env': deploy_env,
+        'from_snapshot': from_snapshot,
+        'seconds': time.time() - start,
+    })
+    return resolved
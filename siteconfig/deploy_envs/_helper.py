@@ -9,8 +9,14 @@ DEPLOY_ENVS_DIR = os.path.dirname(os.path.realpath(__file__))
 SITECONFIG_DIR  = os.path.normpath(os.path.join(DEPLOY_ENVS_DIR, '../'))
 PROJECT_DIR     = os.path.normpath(os.path.join(DEPLOY_ENVS_DIR, '../../'))
 
+DB_DIR          = os.path.join(SITECONFIG_DIR, 'db/')
+
 USER_SECRETS_DIR = os.path.join(os.environ.get('HOME', ''), '.twistsecrets/')
 
+# Files the SECRET_KEY is read from, in order of preference
+USER_SECRET_KEY_FILE  = os.path.join(USER_SECRETS_DIR, 'site_key.txt')
+LOCAL_SECRET_KEY_FILE = os.path.join(DEPLOY_ENVS_DIR, 'local_site_key.txt')
+
 def get_secret_key():
     """
     Retrieve the SECRET_KEY for the current site. If it doesn't exist, it will
@@ -24,14 +30,14 @@ def get_secret_key():
     If none exist, the second file will be created with a random site key.
     """
     # Try the User secret
-    user_secrets = os.path.join(USER_SECRETS_DIR, 'site_key.txt')
+    user_secrets = USER_SECRET_KEY_FILE
     if os.path.exists(user_secrets):
         with open(user_secrets, 'r') as f:
             secret = f.read().strip()
         return secret
 
     # User secret not found. Let's try local key
-    local_key = os.path.join(DEPLOY_ENVS_DIR, 'local_site_key.txt')
+    local_key = LOCAL_SECRET_KEY_FILE
     if not os.path.exists(local_key):
         # Key file not found. Let's create one and fill it with random chars
         from random import choice
@@ -46,3 +52,75 @@ def get_secret_key():
     with open(local_key, 'r') as f:
         secret = f.read().strip()
     return secret
+
+def sqlite_database(name, tuned=False, **tuning):
+    """
+    Returns a DATABASES entry for the SQLite database of the given name, kept
+    in siteconfig/db/.
+
+    If tuned is True, the database uses siteconfig.db_backends.sqlite3_tuned,
+    and the keyword arguments override its tuning options, e.g.
+    synchronous='FULL' or busy_timeout=10000.
+    """
+    try:
+        os.mkdir(DB_DIR)
+    except OSError:
+        pass
+
+    database = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(DB_DIR, name + '.sqlite3'),
+        'USER': '',
+        'PASSWORD': '',
+        'HOST': '',
+        'PORT': '',
+    }
+    if tuned:
+        database['ENGINE'] = 'siteconfig.db_backends.sqlite3_tuned'
+        database['TUNING'] = dict((k.upper(), v) for k, v in tuning.items())
+    return database
+
+def postgresql_pool_database(name, user='', password='', host='', port='',
+                             **pool):
+    """
+    Returns a DATABASES entry for a PostgreSQL database accessed through the
+    process-local connection pool of siteconfig.db_backends.postgresql_pool.
+
+    The keyword arguments set the pool options, e.g. min_size=2, max_size=20,
+    max_idle=300, timeout=30 or check_on_checkout=False.
+    """
+    return {
+        'ENGINE': 'siteconfig.db_backends.postgresql_pool',
+        'NAME': name,
+        'USER': user,
+        'PASSWORD': password,
+        'HOST': host,
+        'PORT': port,
+        'POOL': dict((k.upper(), v) for k, v in pool.items()),
+    }
+
+def cached_template_loaders(*loaders):
+    """
+    Returns a TEMPLATE_LOADERS setting that keeps the templates found by the
+    given loaders compiled in memory, so that they are read and parsed only once
+    per process. Defaults to the filesystem and app_directories loaders.
+    """
+    if not loaders:
+        loaders = ('django.template.loaders.filesystem.Loader',
+                   'django.template.loaders.app_directories.Loader')
+    return (('django.template.loaders.cached.Loader', loaders),)
+
+# South database modules for the backends in siteconfig.db_backends
+SOUTH_ADAPTERS = {
+    'siteconfig.db_backends.postgresql_pool': 'south.db.postgresql_psycopg2',
+    'siteconfig.db_backends.sqlite3_tuned': 'south.db.sqlite3',
+}
+
+def south_database_adapters(databases):
+    """
+    Returns the SOUTH_DATABASE_ADAPTERS setting South needs for the given
+    DATABASES, since it does not know the backends in siteconfig.db_backends.
+    """
+    return dict((alias, SOUTH_ADAPTERS[db['ENGINE']])
+                for alias, db in databases.items()
+                if db['ENGINE'] in SOUTH_ADAPTERS)
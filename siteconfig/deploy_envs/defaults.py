@@ -72,6 +72,12 @@ STATICFILES_FINDERS = (
 #    'django.contrib.staticfiles.finders.DefaultStorageFinder',
 )
 
+# Storage of the collected static files. The deploy environments collecting
+# them with "manage.py collecthashed" (BasicTarget.HASHED_STATIC) use
+# 'siteconfig.static_manifest.ManifestStaticFilesStorage', which serves them
+# under content-hashed names.
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
 # List of callables that know how to import templates from various sources.
 TEMPLATE_LOADERS = (
     'django.template.loaders.filesystem.Loader',
@@ -79,7 +85,17 @@ TEMPLATE_LOADERS = (
 #     'django.template.loaders.eggs.Loader',
 )
 
+# Compile every template when Django is set up by siteconfig/wsgi.py: on the
+# first request of each process, or in the master process when it is preloaded
+# (DJANGO_WSGI_PRELOAD). The first request waits for it, and the next ones
+# don't parse templates. Only useful with cached template loaders, which the
+# deploy environments get from _helper.cached_template_loaders().
+TEMPLATE_WARMUP = False
+
 MIDDLEWARE_CLASSES = (
+    # First, to time the others too
+    'siteconfig.middleware.TimingMiddleware',
+    'siteconfig.middleware.QueryStatsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,6 +105,55 @@ MIDDLEWARE_CLASSES = (
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+# Two tier cache: a small LRU cache in the memory of each process, in front of
+# a file based cache shared by the processes of the host. The shared tier may be
+# replaced by memcached in the deploy environments. See
+# siteconfig/cache_backends.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'siteconfig.cache_backends.TieredCache',
+        'LOCATION': 'shared',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 30,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(_helper.SITECONFIG_DIR, 'cache/'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Session storage. Instead of the database, the deploy environments may use:
+# - 'django.contrib.sessions.backends.signed_cookies', keeping the session in a
+#   signed cookie and nothing on the server;
+# - 'siteconfig.sessions', keeping the session in the SESSION_CACHE_ALIAS cache
+#   and saving it to the database every SESSION_WRITE_BEHIND_INTERVAL seconds.
+#   The cache must be shared by all the hosts (e.g. memcached), unless
+#   SESSION_CACHE_SINGLE_HOST is set.
+# Expired sessions are removed from the database with "manage.py purgesessions".
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_CACHE_ALIAS = 'shared'
+SESSION_WRITE_BEHIND_INTERVAL = 5
+SESSION_CACHE_SINGLE_HOST = False
+
+# Seconds a new process may take to load the settings, apps, middleware and
+# URLconf. Checked by "manage.py startupprofile", and by the tests when
+# STARTUP_BUDGET_ENFORCED is set (or the STARTUP_BUDGET_ENFORCED environment
+# variable is 1), e.g. on the CI server: timings are too noisy on a busy
+# developer machine.
+STARTUP_BUDGET = 2.0
+STARTUP_BUDGET_ENFORCED = False
+
+# File with the version of the current deploy, written by
+# BasicTarget.restart_app. Cached pages of other versions are not used.
+DEPLOY_VERSION_FILE = os.path.join(_helper.SITECONFIG_DIR, 'deploy_version.txt')
+
 ROOT_URLCONF = 'siteconfig.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -101,6 +166,17 @@ TEMPLATE_DIRS = (
     os.path.join(_helper.SITECONFIG_DIR, 'templates/') ,
 )
 
+# How the admin and admindocs are mounted by siteconfig/urls.py:
+# - 'enabled': the admin modules of the apps are discovered when the URLconf is
+#   loaded;
+# - 'lazy': the admin modules are discovered, and admindocs loaded, by the first
+#   request to the admin (or the first reverse());
+# - 'disabled': there is no admin. The admin apps may also be added to
+#   DISABLED_APPS to not install them at all.
+# The DJANGO_ADMIN_MODE environment variable (or Apache SetEnv directive)
+# overrides it, e.g. to disable the admin on public app servers only.
+ADMIN_MODE = 'enabled'
+
 INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -115,6 +191,20 @@ INSTALLED_APPS = (
     'south'
 )
 
+# The request statistics of TimingMiddleware can be dumped to a file every
+# REQUEST_STATS_INTERVAL seconds, e.g. '/tmp/twist-stats-%(pid)s.json'. They can
+# also be read from /_stats/ by the staff and the INTERNAL_IPS.
+REQUEST_STATS_FILE = None
+REQUEST_STATS_INTERVAL = 60
+
+# QueryStatsMiddleware logs to twist.sql the requests running the same SQL
+# statement more than SQL_REPEAT_THRESHOLD times (N+1 queries) or spending more
+# than SQL_SLOW_REQUEST seconds in the database, with their SQL_SLOWEST slowest
+# statements.
+SQL_REPEAT_THRESHOLD = 10
+SQL_SLOW_REQUEST = 0.5
+SQL_SLOWEST = 5
+
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
 # the site admins on every HTTP 500 error.
@@ -124,10 +214,17 @@ LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'handlers': {
+        # Mails from a background thread: the first of each traceback right
+        # away, its repeats in one mail at the end of 'window' seconds
         'mail_admins': {
             'level': 'ERROR',
-            'class': 'django.utils.log.AdminEmailHandler'
-        }
+            'class': 'siteconfig.log_handlers.QueuedAdminEmailHandler',
+            'window': 60,
+        },
+        'console': {
+            'level': 'DEBUG',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -135,6 +232,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'twist.sql': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
@@ -4,22 +4,12 @@ import os
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
-_DB_DIR = os.path.join(_helper.SITECONFIG_DIR, 'db/')
-try:
-    os.mkdir(_DB_DIR)
-except OSError:
-    pass
-
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(_DB_DIR, 'dev.sqlite3'),
-        'USER': '',
-        'PASSWORD': '',
-        'HOST': '',
-        'PORT': '',
-    }
+    'default': _helper.sqlite_database('dev'),
 }
 
+# A single host, whose file cache may keep the sessions
+SESSION_CACHE_SINGLE_HOST = True
+
 MEDIA_ROOT = os.path.join(_helper.SITECONFIG_DIR, 'media/')
 STATIC_ROOT = ''
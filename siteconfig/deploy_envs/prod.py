@@ -4,22 +4,37 @@ import os
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
-_DB_DIR = os.path.join(_helper.SITECONFIG_DIR, 'db/')
-try:
-    os.mkdir(_DB_DIR)
-except OSError:
-    pass
+# Templates are parsed once per process and compiled at startup
+TEMPLATE_LOADERS = _helper.cached_template_loaders()
+TEMPLATE_WARMUP = True
 
+# SQLite tuned for concurrent workers (WAL journal, synchronous=NORMAL). Use
+# _helper.sqlite_database('prod') for SQLite's defaults.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(_DB_DIR, 'prod.sqlite3'),
-        'USER': '',
-        'PASSWORD': '',
-        'HOST': '',
-        'PORT': '',
-    }
+    'default': _helper.sqlite_database('prod', tuned=True),
 }
+SOUTH_DATABASE_ADAPTERS = _helper.south_database_adapters(DATABASES)
+
+# To use PostgreSQL with a pool of persistent connections instead, replace the
+# DATABASES above with:
+#
+# DATABASES = {
+#     'default': _helper.postgresql_pool_database(
+#         '<DATABASE_NAME>', user='<DATABASE_USER>', host='localhost',
+#         min_size=2, max_size=10, max_idle=300),
+# }
+# SOUTH_DATABASE_ADAPTERS = _helper.south_database_adapters(DATABASES)
+
+# Once SESSION_CACHE_ALIAS is a cache shared by all the hosts (memcached),
+# sessions may live in the cache and be written behind to the database with:
+#
+# SESSION_ENGINE = 'siteconfig.sessions'
 
 MEDIA_ROOT = os.path.join(_helper.SITECONFIG_DIR, 'media/')
 STATIC_ROOT = ''
+
+# To collect the static files incrementally under hashed names, turn on
+# HASHED_STATIC in the deploy targets of this environment, so that every deploy
+# updates the manifest, and set:
+#
+# STATICFILES_STORAGE = 'siteconfig.static_manifest.ManifestStaticFilesStorage'
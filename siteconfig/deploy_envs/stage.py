@@ -4,21 +4,12 @@ import os
 DEBUG = True
 TEMPLATE_DEBUG = DEBUG
 
-_DB_DIR = os.path.join(_helper.SITECONFIG_DIR, 'db/')
-try:
-    os.mkdir(_DB_DIR)
-except OSError:
-    pass
+# Templates are parsed once per process and compiled at startup
+TEMPLATE_LOADERS = _helper.cached_template_loaders()
+TEMPLATE_WARMUP = True
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(_DB_DIR, 'stage.sqlite3'),
-        'USER': '',
-        'PASSWORD': '',
-        'HOST': '',
-        'PORT': '',
-    }
+    'default': _helper.sqlite_database('stage'),
 }
 
 MEDIA_ROOT  = '/home/<PROJECT_USERNAME>/public_html/media/'
@@ -26,3 +17,9 @@ STATIC_ROOT = '/home/<PROJECT_USERNAME>/public_html/static/'
 
 MEDIA_URL   = 'http://<PROJECT_USERNAME>.twistsystems.com/media/'
 STATIC_URL  = 'http://<PROJECT_USERNAME>.twistsystems.com/static/'
+
+# To collect the static files incrementally under hashed names, turn on
+# HASHED_STATIC in the deploy targets of this environment, so that every deploy
+# updates the manifest, and set:
+#
+# STATICFILES_STORAGE = 'siteconfig.static_manifest.ManifestStaticFilesStorage'
@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration for TWIST, loading the application in the master
+process and sharing it with the workers:
+
+    DJANGO_DEPLOY_ENV=prod gunicorn -c siteconfig/gunicorn_conf.py \\
+        siteconfig.wsgi:application
+
+The application is preloaded with DJANGO_WSGI_PRELOAD=freeze unless the
+environment says otherwise, see siteconfig.wsgi and siteconfig.prefork.
+"""
+
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_WSGI_PRELOAD', 'freeze')
+
+preload_app = True
+workers = multiprocessing.cpu_count() * 2 + 1
+
+def post_fork(server, worker):
+    from siteconfig.prefork import post_fork
+    post_fork(server, worker)
@@ -0,0 +1,169 @@
+"""
+Logging handlers.
+
+QueuedAdminEmailHandler mails the errors to the ADMINS like Django's
+AdminEmailHandler, but without making the failing request wait for the mail
+server. The records are formatted and queued by the logging thread, and sent by
+a background thread. The first record with a given traceback (or message, when
+it has no traceback) is sent right away; the records repeating it within the
+window of seconds that follows are sent as one mail at the end of the window,
+with their count in the subject. When the queue is full, the records are
+dropped and counted in the next mail, so an error storm costs little more than
+the formatting of the tracebacks.
+"""
+
+import logging
+import os
+import Queue
+import threading
+import time
+import traceback
+
+# Queued by flush() with an event to set once everything before it was sent
+_FLUSH = object()
+
+
+class QueuedAdminEmailHandler(logging.Handler):
+    """
+    Mails the ADMINS the records it handles from a background thread, grouping
+    the repeated tracebacks.
+    """
+
+    def __init__(self, window=60, max_queue=1000):
+        logging.Handler.__init__(self)
+        self.window = window
+        self.queue = Queue.Queue(max_queue)
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start_worker(self):
+        # The thread is started by the first record of each process, since a
+        # preforking server doesn't fork threads
+        with self._lock:
+            if self._pid != os.getpid():
+                thread = threading.Thread(target=self._work,
+                                          name='QueuedAdminEmailHandler')
+                thread.daemon = True
+                thread.start()
+                self._pid = os.getpid()
+
+    def group_key(self, record):
+        """
+        Returns what the records sent together have in common: the type and
+        traceback of the exception (but not its message), or else the logger
+        and the message before its arguments.
+        """
+        if record.exc_info:
+            exc_type, exc_value, tb = record.exc_info
+            return (exc_type.__name__,
+                    tuple(entry[:3] for entry in traceback.extract_tb(tb)))
+        return '%s %s %s' % (record.name, record.levelname, record.msg)
+
+    def _formatter(self):
+        return self.formatter or logging.Formatter()
+
+    def format_mail(self, record):
+        """
+        Returns the subject and body of the mail about the given record.
+        """
+        subject = '%s: %s' % (record.levelname, record.getMessage())
+        request = getattr(record, 'request', None)
+        body = self._formatter().format(record)
+        if request is not None:
+            body += '\n\nRequest: %s %s\nFrom: %s' % (
+                request.method, request.get_full_path(),
+                request.META.get('REMOTE_ADDR'))
+        # Subjects can't contain newlines
+        return subject.splitlines()[0][:989], body
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start_worker()
+            subject, body = self.format_mail(record)
+            self.queue.put_nowait((self.group_key(record), subject, body,
+                                   time.time()))
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout=10):
+        """
+        Sends the records queued so far without waiting for the end of their
+        window, and waits for them to be sent.
+        """
+        if self._pid != os.getpid():
+            return
+        done = threading.Event()
+        try:
+            self.queue.put((_FLUSH, done), timeout=timeout)
+        except Queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+    def _work(self):
+        groups = {}
+        while True:
+            if groups:
+                first = min(group['first'] for group in groups.values())
+                timeout = max(first + self.window - time.time(), 0)
+            else:
+                timeout = None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                item = None
+
+            if item is not None and item[0] is _FLUSH:
+                self._send([group for group in groups.values()
+                            if group['repeats']])
+                groups.clear()
+                item[1].set()
+                continue
+            if item is not None:
+                key, subject, body, created = item
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = group = {'subject': subject, 'body': body,
+                                           'first': created, 'repeats': 0}
+                    self._send([group])
+                else:
+                    group['repeats'] += 1
+
+            now = time.time()
+            due = [groups.pop(key) for key, group in groups.items()
+                   if group['first'] + self.window <= now]
+            self._send([group for group in due if group['repeats']])
+
+    def _send(self, groups):
+        """
+        Mails the first record of each of the given groups, or the count of
+        its repeats when there were any.
+        """
+        from django.core.mail import mail_admins
+
+        for group in sorted(groups, key=lambda group: group['first']):
+            subject = group['subject']
+            body = group['body']
+            if group['repeats']:
+                subject = '[%d more times] %s' % (group['repeats'], subject)
+                body = ('This error happened %d more times in the %d seconds'
+                        ' after it was first mailed.\n\n%s'
+                        % (group['repeats'], self.window, body))
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                body += ('\n\n%d other records were dropped, the queue was'
+                         ' full.' % dropped)
+            try:
+                mail_admins(subject, body, fail_silently=True)
+            except Exception:
+                # Never let the worker die
+                pass
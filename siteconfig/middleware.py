@@ -0,0 +1,194 @@
+"""
+Request timing.
+
+TimingMiddleware records the latency of every request in a histogram of fixed
+buckets per view, along with the number of requests, of server errors and of
+bytes sent. The requests are grouped by the view they were resolved to (by
+module and name, which is also the default name of their URL pattern), or
+under UNRESOLVED when no view was found. Recording a request costs a few
+dictionary and list operations; nothing is allocated per request once a view
+has been seen.
+
+The statistics are kept in memory per process, since the counts are only
+meaningful together with the uptime of the process. They can be read from the
+stats view of siteconfig.views, or dumped to REQUEST_STATS_FILE every
+REQUEST_STATS_INTERVAL seconds by the request that happens to be running then.
+
+QueryStatsMiddleware counts and times the SQL queries of every request with
+siteconfig.sql, and logs the requests with repeated queries (N+1 patterns) or
+too much time spent in the database to the twist.sql logger.
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from siteconfig import sql
+
+sql_logger = logging.getLogger('twist.sql')
+
+# Upper bounds of the latency buckets, in milliseconds. The last bucket has no
+# upper bound.
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Key of the requests not resolved to a view, e.g. 404s and redirects of the
+# CommonMiddleware
+UNRESOLVED = '<unresolved>'
+
+_stats = {}
+_lock = threading.Lock()
+_started = time.time()
+_last_dump = [time.time()]
+
+def _new_entry():
+    return {
+        'count': 0,
+        'errors': 0,
+        'bytes': 0,
+        'seconds': 0.0,
+        'max_seconds': 0.0,
+        'buckets': [0] * (len(BUCKETS) + 1),
+    }
+
+def record(key, seconds, status, size):
+    """
+    Records a request to the given view that took the given time.
+    """
+    bucket = bisect.bisect_left(BUCKETS, seconds * 1000)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = _new_entry()
+        entry['count'] += 1
+        if status >= 500:
+            entry['errors'] += 1
+        entry['bytes'] += size
+        entry['seconds'] += seconds
+        if seconds > entry['max_seconds']:
+            entry['max_seconds'] = seconds
+        entry['buckets'][bucket] += 1
+
+def snapshot():
+    """
+    Returns a copy of the statistics of this process: a dict with its 'pid',
+    the 'uptime' in seconds, the upper bounds of the 'buckets' and the 'views'
+    with the statistics of each view.
+    """
+    with _lock:
+        views = dict((key, dict(entry, buckets=list(entry['buckets'])))
+                     for key, entry in _stats.items())
+    return {
+        'pid': os.getpid(),
+        'uptime': time.time() - _started,
+        'buckets': list(BUCKETS),
+        'views': views,
+    }
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+def dump(path):
+    """
+    Writes the statistics of this process to the given file, in which
+    %(pid)s is replaced by the process id. The file is replaced atomically.
+    """
+    path = path % {'pid': os.getpid()}
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+    return path
+
+def _response_size(response):
+    # Don't consume the responses with an iterator for their content
+    length = response.get('Content-Length')
+    if length is not None:
+        return int(length)
+    if getattr(response, '_base_content_is_iter', False):
+        return 0
+    return len(response.content)
+
+
+class TimingMiddleware(object):
+    """
+    Records the latency, status and size of every response. It should be the
+    first of the MIDDLEWARE_CLASSES, to time all of them.
+    """
+
+    def __init__(self):
+        self.dump_file = getattr(settings, 'REQUEST_STATS_FILE', None)
+        self.dump_interval = getattr(settings, 'REQUEST_STATS_INTERVAL', 60)
+
+    def process_request(self, request):
+        request._timing_start = time.time()
+        request._timing_view = UNRESOLVED
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing_view = '%s.%s' % (
+            view_func.__module__,
+            getattr(view_func, '__name__', view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        start = getattr(request, '_timing_start', None)
+        if start is None:
+            # An earlier middleware answered before process_request
+            return response
+        now = time.time()
+        record(request._timing_view, now - start, response.status_code,
+               _response_size(response))
+
+        if self.dump_file and now - _last_dump[0] >= self.dump_interval:
+            _last_dump[0] = now
+            dump(self.dump_file)
+        return response
+
+
+class QueryStatsMiddleware(object):
+    """
+    Records the SQL queries of every request. The requests running a statement
+    more than SQL_REPEAT_THRESHOLD times, or spending more than
+    SQL_SLOW_REQUEST seconds in queries, are logged as warnings with their
+    SQL_SLOWEST slowest statements, the others at the debug level.
+    """
+
+    def __init__(self):
+        self.repeat_threshold = getattr(settings, 'SQL_REPEAT_THRESHOLD', 10)
+        self.slow_request = getattr(settings, 'SQL_SLOW_REQUEST', 0.5)
+        self.slowest = getattr(settings, 'SQL_SLOWEST', 5)
+
+    def process_request(self, request):
+        for connection in connections.all():
+            sql.instrument(connection)
+        sql.start_recording(self.slowest)
+
+    def process_response(self, request, response):
+        recorder = sql.stop_recording()
+        if recorder is None:
+            return response
+
+        repeated = recorder.repeated(self.repeat_threshold)
+        if repeated or recorder.seconds > self.slow_request:
+            lines = ['%s %s: %d queries in %.1f ms' % (
+                request.method, request.path, recorder.count,
+                recorder.seconds * 1000)]
+            for count, sql_shape in repeated:
+                lines.append('  repeated %d times: %s' % (count, sql_shape))
+            for seconds, statement in recorder.slowest():
+                lines.append('  %.1f ms: %s' % (seconds * 1000, statement))
+            sql_logger.warning('\n'.join(lines), extra={
+                'queries': recorder.count,
+                'query_seconds': recorder.seconds,
+            })
+        else:
+            # Formatted only if debug messages are logged
+            sql_logger.debug('%s %s: %d queries in %.1f ms', request.method,
+                             request.path, recorder.count,
+                             recorder.seconds * 1000)
+        return response
@@ -0,0 +1,128 @@
+"""
+Copy-on-write friendly preforking.
+
+A preforking server (e.g. gunicorn --preload) which loads the application in
+its master process shares the memory of everything loaded with its workers,
+until a worker writes to it. The garbage collector writes to every object it
+scans, so the first full collection in a worker copies most of the memory it
+inherited. freeze() is meant to be called in the master once everything is
+loaded, see DJANGO_WSGI_PRELOAD in siteconfig.wsgi: it collects the garbage,
+then keeps the objects left out of the reach of the collector with
+gc.freeze(), where available (Python 3.7). Python 2.7 has no such thing, so
+there it only makes full collections rare, by raising their threshold: the
+objects loaded by the master are left alone by the collections of the younger
+generations, but each full collection still scans and copies them. Reference
+counting also writes to the objects in use, so some pages are copied anyway.
+
+close_connections() is to be called in the master before forking (preload()
+in siteconfig.wsgi does), and post_fork() in each worker after the fork. The
+gunicorn configuration in siteconfig/gunicorn_conf.py does both, and
+siteconfig.wsgi registers post_fork() with uWSGI when it runs under it.
+
+memory_usage() reads the shared and private memory of processes from
+/proc/<pid>/smaps, see the memreport command.
+"""
+
+import gc
+import os
+import random
+
+# Threshold of the full collections when gc.freeze() is not available: the
+# number of collections of the middle generation before a full one (10 by
+# default)
+FULL_COLLECTION_THRESHOLD = 1000
+
+def freeze():
+    """
+    Collects the garbage and keeps the objects left out of the future
+    collections with gc.freeze(), returning 'freeze'. Without gc.freeze(), as
+    on Python 2.7, only raises the threshold of the full collections to
+    FULL_COLLECTION_THRESHOLD and returns 'threshold'.
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        return 'freeze'
+    threshold0, threshold1, threshold2 = gc.get_threshold()
+    gc.set_threshold(threshold0, threshold1,
+                     max(threshold2, FULL_COLLECTION_THRESHOLD))
+    return 'threshold'
+
+def close_connections():
+    """
+    Closes the database connections of the master, and the idle connections of
+    the pools, so that no worker inherits them. To be called once everything is
+    loaded, before forking.
+    """
+    from django.db import connections
+    for connection in connections.all():
+        connection.close()
+        if hasattr(connection, 'close_pool'):
+            connection.close_pool()
+
+def post_fork(server=None, worker=None):
+    """
+    Prepares a forked worker: forgets the database connections inherited from
+    the master, and seeds the random number generator, which would otherwise
+    produce the same numbers in every worker. The arguments of the gunicorn
+    hook are ignored.
+
+    The connections are dropped without being closed: closing one would end
+    the session (e.g. send a Terminate message to PostgreSQL) over the socket
+    the master and the other workers share.
+    """
+    from django.db import connections
+    for connection in connections.all():
+        connection.connection = None
+        if hasattr(connection, 'forget_pool'):
+            connection.forget_pool()
+    random.seed()
+
+def _smaps_path(pid):
+    # smaps_rollup (Linux 4.14) has the totals, and is much faster to read
+    path = '/proc/%d/smaps_rollup' % pid
+    if os.path.exists(path):
+        return path
+    return '/proc/%d/smaps' % pid
+
+def memory_usage(pid):
+    """
+    Returns the memory of the given process, in kB, as a dict with its 'rss',
+    the part of it 'shared' with other processes and the 'private' part, and
+    its 'pss' (the private memory plus its share of the shared memory).
+    """
+    fields = {}
+    with open(_smaps_path(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0]] = fields.get(parts[0], 0) + int(parts[1])
+    return {
+        'rss': fields.get('Rss:', 0),
+        'pss': fields.get('Pss:', 0),
+        'shared': (fields.get('Shared_Clean:', 0)
+                   + fields.get('Shared_Dirty:', 0)),
+        'private': (fields.get('Private_Clean:', 0)
+                    + fields.get('Private_Dirty:', 0)),
+    }
+
+def find_processes(match):
+    """
+    Returns the ids of the processes of the current user whose command line
+    contains the given string, except this one.
+    """
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        try:
+            if os.stat('/proc/' + name).st_uid != os.getuid():
+                continue
+            with open('/proc/%s/cmdline' % name) as f:
+                cmdline = f.read().replace('\0', ' ')
+        except (IOError, OSError):
+            # Gone already
+            continue
+        if match in cmdline:
+            pids.append(int(name))
+    return sorted(pids)
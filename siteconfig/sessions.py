@@ -0,0 +1,225 @@
+"""
+Cache backed session store with write-behind to the database.
+
+Sessions are read from and written to the cache named by SESSION_CACHE_ALIAS.
+Writes are also queued and saved to the database in batches by a background
+thread every SESSION_WRITE_BEHIND_INTERVAL seconds, so requests don't wait for
+the database and workers don't serialize on the session table. The database
+copy is only read when the session is not in the cache. Saving a session whose
+data did not change since it was loaded does nothing.
+
+If the process dies, the writes still in the queue are lost from the database,
+but not from the cache. Use it by setting SESSION_ENGINE = 'siteconfig.sessions'.
+
+The next request of a user may reach any host, so the cache must be shared by
+every host (memcached, or the database cache), not only by the processes of one
+host like the file cache. This is checked when the module is imported, unless
+SESSION_CACHE_SINGLE_HOST says the deploy environment runs on a single host.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase, CreateError
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+from django.utils.log import getLogger
+
+from siteconfig.cache import get_cache_instance
+
+KEY_PREFIX = 'siteconfig.sessions'
+
+logger = getLogger('django.request')
+
+# Cache backends shared by all the hosts
+CLUSTER_CACHE_BACKENDS = (
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.db.DatabaseCache',
+)
+
+def check_cache(alias):
+    """
+    Raises ImproperlyConfigured if the cache of the given alias is not shared
+    by all the hosts, and SESSION_CACHE_SINGLE_HOST is not set.
+    """
+    if getattr(settings, 'SESSION_CACHE_SINGLE_HOST', False):
+        return
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in CLUSTER_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            'siteconfig.sessions must keep the sessions in a cache shared by'
+            ' all the hosts, such as memcached, but the "%s" cache is %s.'
+            ' Set SESSION_CACHE_SINGLE_HOST if there is only one host.'
+            % (alias, backend))
+
+check_cache(getattr(settings, 'SESSION_CACHE_ALIAS', 'default'))
+
+
+class WriteBehindQueue(object):
+    """
+    Sessions waiting to be saved to the database, and the thread saving them.
+    Only the latest data of each session is kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pid = None
+
+    def _start(self):
+        # Must be called with the lock held. Threads do not survive a fork, so
+        # there is one per process.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run,
+                                      name='session-write-behind')
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(getattr(settings, 'SESSION_WRITE_BEHIND_INTERVAL', 5))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to save sessions to the database')
+
+    def put(self, session_key, session_data, expire_date):
+        with self._lock:
+            self._pending[session_key] = (session_data, expire_date)
+            self._start()
+
+    def get(self, session_key):
+        """
+        Returns the pending data of the given session, or None.
+        """
+        with self._lock:
+            item = self._pending.get(session_key)
+        return item and item[0]
+
+    def discard(self, session_key):
+        with self._lock:
+            self._pending.pop(session_key, None)
+
+    def flush(self):
+        """
+        Saves the pending sessions to the database in a single transaction.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        using = router.db_for_write(Session)
+        try:
+            with transaction.commit_on_success(using=using):
+                for session_key, (data, expire_date) in pending.iteritems():
+                    Session(session_key=session_key, session_data=data,
+                            expire_date=expire_date).save(using=using)
+        except:
+            # Try again next time, unless the sessions changed meanwhile
+            with self._lock:
+                pending.update(self._pending)
+                self._pending = pending
+            raise
+        finally:
+            # Don't keep a connection open in the background thread
+            connections[using].close()
+
+write_behind_queue = WriteBehindQueue()
+atexit.register(write_behind_queue.flush)
+
+
+class SessionStore(SessionBase):
+    """
+    Implements cache backed sessions written behind to the database.
+    """
+
+    def __init__(self, session_key=None):
+        self._cache = get_cache_instance(
+            getattr(settings, 'SESSION_CACHE_ALIAS', 'default'))
+        # Encoded data of the session as loaded, to skip unchanged saves
+        self._loaded_data = None
+        super(SessionStore, self).__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return KEY_PREFIX + self._get_or_create_session_key()
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key, None)
+        except Exception:
+            # Some backends (e.g. memcache) raise an exception on invalid
+            # cache keys.
+            data = None
+        if data is None:
+            data = write_behind_queue.get(self.session_key)
+        if data is None:
+            try:
+                data = Session.objects.get(
+                    session_key=self.session_key,
+                    expire_date__gt=timezone.now()
+                ).session_data
+            except (Session.DoesNotExist, SuspiciousOperation):
+                self._session_key = None
+                return {}
+            self._cache.set(self.cache_key, data, settings.SESSION_COOKIE_AGE)
+        self._loaded_data = data
+        return self.decode(force_unicode(data))
+
+    def exists(self, session_key):
+        # Only used to pick new session keys, which are random enough that the
+        # database is not worth a query.
+        if (KEY_PREFIX + session_key) in self._cache:
+            return True
+        return write_behind_queue.get(session_key) is not None
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                # Key wasn't unique. Try again.
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        session = self._get_session(no_load=must_create)
+        if (not must_create and self._loaded_data is not None
+                and session == self.decode(force_unicode(self._loaded_data))):
+            return
+
+        data = self.encode(session)
+        timeout = self.get_expiry_age()
+        if must_create:
+            if not self._cache.add(self.cache_key, data, timeout):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, timeout)
+        self._loaded_data = data
+        write_behind_queue.put(self.session_key, data, self.get_expiry_date())
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(KEY_PREFIX + session_key)
+        write_behind_queue.discard(session_key)
+        Session.objects.filter(session_key=session_key).delete()
+
+
+# At bottom to avoid circular import
+from django.contrib.sessions.models import Session
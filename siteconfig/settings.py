@@ -1,43 +1,20 @@
 """
 Settings for the current site. This file is heavily based on David Cramer's
 post on http://justcramer.com/2011/01/13/settings-in-django/
+
+The defaults, the deploy environment settings and the DISABLED_APPS are
+resolved by deploy_envs._compiler, which keeps a frozen snapshot of the result
+for each deploy environment. The DJANGO_ADMIN_MODE environment variable
+overrides ADMIN_MODE.
 """
 import os
 
-# Load configuration defaults
-from deploy_envs.defaults import *
+from deploy_envs import _compiler
 
 # Load deploy environment specific settings
 
 DJANGO_DEPLOY_ENV = os.environ.get('DJANGO_DEPLOY_ENV', 'dev')
-if DJANGO_DEPLOY_ENV != 'defaults':
-    module = __import__('deploy_envs.' + DJANGO_DEPLOY_ENV,
-                        globals(), locals(), ['*'])
-
-    for k in dir(module):
-        if k[0] == '_':
-            continue
-        locals()[k] = getattr(module, k)
-
-
-## Remove disabled apps
-
-if 'DISABLED_APPS' in locals():
-    INSTALLED_APPS = [k for k in INSTALLED_APPS if k not in DISABLED_APPS]
-
-    MIDDLEWARE_CLASSES = list(MIDDLEWARE_CLASSES)
-    DATABASE_ROUTERS = list(DATABASE_ROUTERS)
-    TEMPLATE_CONTEXT_PROCESSORS = list(TEMPLATE_CONTEXT_PROCESSORS)
-
-    for a in DISABLED_APPS:
-        for x, m in enumerate(MIDDLEWARE_CLASSES):
-            if m.startswith(a):
-                MIDDLEWARE_CLASSES.pop(x)
 
-        for x, m in enumerate(TEMPLATE_CONTEXT_PROCESSORS):
-            if m.startswith(a):
-                TEMPLATE_CONTEXT_PROCESSORS.pop(x)
+globals().update(_compiler.load_settings(DJANGO_DEPLOY_ENV))
 
-        for x, m in enumerate(DATABASE_ROUTERS):
-            if m.startswith(a):
-                DATABASE_ROUTERS.pop(x)
+ADMIN_MODE = os.environ.get('DJANGO_ADMIN_MODE', ADMIN_MODE)
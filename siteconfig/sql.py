@@ -0,0 +1,136 @@
+"""
+SQL query instrumentation.
+
+instrument() wraps the cursors of a database connection so that the queries
+run by the current thread are counted and timed while a QueryRecorder is
+started with start_recording(). Unlike the debug cursors of Django, this works
+with DEBUG off and keeps nothing between requests: a recorder keeps the number
+of queries, their total time, the slowest statements and the number of times
+each SQL "shape" (the statement with its literals replaced) was run, which
+tells the N+1 patterns apart. See QueryStatsMiddleware in siteconfig.middleware.
+"""
+
+import functools
+import heapq
+import re
+import threading
+import time
+
+from django.db.backends.util import CursorWrapper
+
+_local = threading.local()
+
+_SHAPE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\bIN\s*\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)', re.I),
+     'IN (...)'),
+)
+
+def shape(sql):
+    """
+    Returns the given statement with its literals and parameter lists replaced,
+    so that the statements differing only by their parameters look the same.
+    """
+    for pattern, replacement in _SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class QueryRecorder(object):
+    """
+    The queries run by a thread while recording.
+    """
+
+    def __init__(self, slowest=5):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = {}
+        self._slowest = []
+        self._slowest_size = slowest
+
+    def add(self, sql, seconds, times=1):
+        self.count += times
+        self.seconds += seconds
+        sql_shape = shape(sql)
+        self.shapes[sql_shape] = self.shapes.get(sql_shape, 0) + times
+        entry = (seconds, sql)
+        if len(self._slowest) < self._slowest_size:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """
+        Returns the slowest statements as (seconds, sql), the slowest first.
+        """
+        return sorted(self._slowest, reverse=True)
+
+    def repeated(self, threshold):
+        """
+        Returns the shapes run more than the given number of times, as (count,
+        shape), the most repeated first.
+        """
+        return sorted(((count, sql_shape) for sql_shape, count
+                       in self.shapes.items() if count > threshold),
+                      reverse=True)
+
+
+class InstrumentedCursor(CursorWrapper):
+    """
+    Cursor recording its queries to the recorder of the current thread, if
+    any. It wraps the cursor Django would have returned, so that the debug
+    cursors still work.
+    """
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            recorder = getattr(_local, 'recorder', None)
+            if recorder is not None:
+                recorder.add(sql, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            recorder = getattr(_local, 'recorder', None)
+            if recorder is not None:
+                try:
+                    times = len(param_list)
+                except TypeError:
+                    times = 1
+                recorder.add(sql, time.time() - start, times)
+
+def _instrumented_cursor(connection, cursor):
+    return InstrumentedCursor(cursor(), connection)
+
+def instrument(connection):
+    """
+    Makes the given connection return instrumented cursors. The connections
+    are per thread, so this is needed once for every thread and connection.
+    """
+    if not getattr(connection, '_instrumented', False):
+        connection.cursor = functools.partial(_instrumented_cursor, connection,
+                                              connection.cursor)
+        connection._instrumented = True
+
+def start_recording(slowest=5):
+    """
+    Starts recording the queries of the current thread to a new recorder, and
+    returns it.
+    """
+    _local.recorder = QueryRecorder(slowest)
+    return _local.recorder
+
+def stop_recording():
+    """
+    Stops recording the queries of the current thread, and returns the
+    recorder, or None if none was started.
+    """
+    recorder = getattr(_local, 'recorder', None)
+    _local.recorder = None
+    return recorder
@@ -0,0 +1,149 @@
+"""
+Startup profiling.
+
+profile_startup() goes through what a new worker or manage.py process does
+before it can handle anything, one phase at a time: loading the settings,
+importing the installed apps and their models, loading the middleware,
+discovering the admin modules and loading the URLconf. It also times every
+module imported along the way.
+
+It is only meaningful in a new process, so profile_in_subprocess() runs it as
+"python -m siteconfig.startup", which prints the result as JSON. This module
+must not import Django before the profile starts. Timing the imports slows them
+down a little, so the phases take a bit longer than they do normally.
+"""
+
+import __builtin__
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Directory manage.py is in
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ImportTimer(object):
+    """
+    Replaces __import__ to time the modules imported for the first time. The
+    cumulative time of a module includes the modules it imports; its own time
+    does not.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self._stack = []
+        self._original_import = None
+
+    def _import(self, name, *args, **kwargs):
+        before = set(sys.modules)
+        start = time.time()
+        self._stack.append(0.0)
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            new = [m for m in set(sys.modules) - before
+                   if sys.modules[m] is not None]
+            if new:
+                # Credit the import to the module asked for, which may be a
+                # relative name, or else to the outermost module loaded
+                asked = [m for m in new
+                         if m == name or m.endswith('.' + name)]
+                module = min(asked or new, key=len)
+                cumulative, own = self.modules.get(module, (0.0, 0.0))
+                self.modules[module] = (cumulative + elapsed,
+                                        own + elapsed - nested)
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def start(self):
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def stop(self):
+        __builtin__.__import__ = self._original_import
+
+
+def _load_settings():
+    from django.conf import settings
+    settings.INSTALLED_APPS
+
+def _load_apps():
+    from django.conf import settings
+    from django.db.models.loading import get_models
+    from django.utils.importlib import import_module
+    for app in settings.INSTALLED_APPS:
+        import_module(app)
+    get_models()
+
+def _load_middleware():
+    from django.core.handlers.wsgi import WSGIHandler
+    WSGIHandler().load_middleware()
+
+def _discover_admin():
+    from django.conf import settings
+    if (settings.ADMIN_MODE == 'enabled'
+            and 'django.contrib.admin' in settings.INSTALLED_APPS):
+        from django.contrib import admin
+        admin.autodiscover()
+
+def _load_urlconf():
+    from django.conf import settings
+    from django.core.urlresolvers import get_resolver
+    get_resolver(settings.ROOT_URLCONF).url_patterns
+
+PHASES = (
+    ('settings', _load_settings),
+    ('apps', _load_apps),
+    ('middleware', _load_middleware),
+    ('admin discovery', _discover_admin),
+    ('urlconf', _load_urlconf),
+)
+
+def profile_startup():
+    """
+    Runs the startup phases and returns a dict with the 'phases' as a list of
+    (name, seconds), the 'modules' as a list of (name, cumulative seconds, own
+    seconds), the slowest first, and the 'total' seconds.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'siteconfig.settings')
+    timer = ImportTimer()
+    phases = []
+    timer.start()
+    try:
+        for name, phase in PHASES:
+            start = time.time()
+            phase()
+            phases.append((name, time.time() - start))
+    finally:
+        timer.stop()
+
+    modules = sorted(((name, cumulative, own) for name, (cumulative, own)
+                      in timer.modules.items()),
+                     key=lambda m: m[2], reverse=True)
+    return {
+        'phases': phases,
+        'modules': modules,
+        'total': sum(seconds for name, seconds in phases),
+    }
+
+def profile_in_subprocess(deploy_env, runs=1):
+    """
+    Profiles the startup of new processes for the given deploy environment,
+    and returns the result of the fastest of the given number of runs.
+    """
+    environ = dict(os.environ, DJANGO_DEPLOY_ENV=deploy_env)
+    environ.pop('DJANGO_SETTINGS_MODULE', None)
+    results = []
+    for i in range(runs):
+        output = subprocess.Popen(
+            [sys.executable, '-m', 'siteconfig.startup'], cwd=PROJECT_DIR,
+            env=environ, stdout=subprocess.PIPE).communicate()[0]
+        results.append(json.loads(output))
+    return min(results, key=lambda result: result['total'])
+
+if __name__ == '__main__':
+    json.dump(profile_startup(), sys.stdout)
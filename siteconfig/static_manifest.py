@@ -0,0 +1,190 @@
+"""
+Incremental collection of static files under content-hashed names.
+
+collect_static() copies the files found by STATICFILES_FINDERS to STATIC_ROOT
+like collectstatic, and also under a name containing the hash of their contents
+(e.g. css/base.3f2a9c1d5e7b.css), which can be cached by browsers forever. The
+hash, size and modification time of every collected file are kept in a manifest
+in STATIC_ROOT, so that the next collection only reads the files whose size or
+modification time changed, and only copies those whose contents changed. The
+outputs of files that changed or disappeared are removed in the same pass.
+
+ManifestStaticFilesStorage returns the hashed URL of collected files, e.g. from
+the {% static %} tag of django.contrib.staticfiles. Files referenced otherwise
+(e.g. relative URLs in stylesheets) are still served from their plain names.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core.exceptions import ImproperlyConfigured
+
+MANIFEST_NAME = 'staticfiles.json'
+
+# Not collected, as by collectstatic
+IGNORE_PATTERNS = ['CVS', '.*', '*~']
+
+
+def hashed_name(name, content_hash):
+    """
+    Returns the name of the given file with the given hash, e.g.
+    css/base.3f2a9c1d5e7b.css.
+    """
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, content_hash[:12], ext)
+
+def file_hash(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def manifest_path(static_root=None):
+    return os.path.join(static_root or settings.STATIC_ROOT, MANIFEST_NAME)
+
+def load_manifest(static_root=None):
+    """
+    Returns the manifest of STATIC_ROOT, a dict of collected names to dicts
+    with their 'hash', 'hashed_name', 'size' and 'mtime'. It is empty if
+    nothing was collected yet.
+    """
+    try:
+        with open(manifest_path(static_root)) as f:
+            return json.load(f)['files']
+    except (IOError, ValueError, KeyError):
+        return {}
+
+def _save_manifest(static_root, files):
+    path = manifest_path(static_root)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': 1, 'files': files}, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+def _copy(source, static_root, name):
+    """
+    Copies the source file to the given name in STATIC_ROOT. The file is
+    replaced atomically, so it is never served half written.
+    """
+    target = os.path.join(static_root, name)
+    try:
+        os.makedirs(os.path.dirname(target))
+    except OSError:
+        pass
+    tmp_target = target + '.tmp'
+    shutil.copy2(source, tmp_target)
+    os.rename(tmp_target, target)
+
+def _remove(static_root, name):
+    try:
+        os.remove(os.path.join(static_root, name))
+    except OSError:
+        pass
+
+def find_static_files(ignore_patterns=IGNORE_PATTERNS):
+    """
+    Returns a dict of the names of the static files to the absolute paths of
+    their sources. As with collectstatic, the first finder to find a name wins.
+    """
+    found = {}
+    for finder in finders.get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            if getattr(storage, 'prefix', None):
+                name = os.path.join(storage.prefix, path)
+            else:
+                name = path
+            name = name.replace(os.sep, '/')
+            if name not in found:
+                found[name] = storage.path(path)
+    return found
+
+def collect_static(static_root=None, log=None):
+    """
+    Collects the static files to STATIC_ROOT, skipping the unchanged ones, and
+    removes the outputs of the files that changed or are gone. Returns a dict
+    with the lists of 'copied', 'unchanged' and 'pruned' names. log, if given,
+    is called with a message for each file copied or removed.
+    """
+    static_root = static_root or settings.STATIC_ROOT
+    if not static_root:
+        # Or everything would be collected to the current directory
+        raise ImproperlyConfigured("You're using the staticfiles app without"
+                                   " having set the STATIC_ROOT setting to a"
+                                   " filesystem path.")
+    log = log or (lambda message: None)
+    old_files = load_manifest(static_root)
+    files = {}
+    copied, unchanged, pruned = [], [], []
+
+    for name, source in sorted(find_static_files().items()):
+        stat = os.stat(source)
+        entry = old_files.get(name)
+        if (entry and entry['size'] == stat.st_size
+                and entry['mtime'] == stat.st_mtime
+                and os.path.exists(os.path.join(static_root,
+                                                entry['hashed_name']))):
+            # Fast path: not even read
+            files[name] = entry
+            unchanged.append(name)
+            continue
+
+        content_hash = file_hash(source)
+        new_entry = {
+            'hash': content_hash,
+            'hashed_name': hashed_name(name, content_hash),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        files[name] = new_entry
+        if (entry and entry['hash'] == content_hash
+                and os.path.exists(os.path.join(static_root,
+                                                entry['hashed_name']))):
+            # Touched but not changed
+            unchanged.append(name)
+            continue
+
+        log("Copying '%s'" % name)
+        _copy(source, static_root, new_entry['hashed_name'])
+        _copy(source, static_root, name)
+        copied.append(name)
+        if entry and entry['hashed_name'] != new_entry['hashed_name']:
+            _remove(static_root, entry['hashed_name'])
+            pruned.append(entry['hashed_name'])
+
+    for name, entry in old_files.items():
+        if name not in files:
+            log("Removing '%s'" % name)
+            _remove(static_root, entry['hashed_name'])
+            _remove(static_root, name)
+            pruned.extend([entry['hashed_name'], name])
+
+    _save_manifest(static_root, files)
+    return {'copied': copied, 'unchanged': unchanged, 'pruned': pruned}
+
+
+class ManifestStaticFilesStorage(StaticFilesStorage):
+    """
+    Static files storage returning the URLs of the hashed copies of the files
+    collected by collect_static(). The manifest is read once per process, since
+    the application is restarted on every deploy. Files not in the manifest get
+    their plain URL.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        self._manifest = None
+
+    def url(self, name):
+        if self._manifest is None:
+            self._manifest = (load_manifest(self.location)
+                              if self.location else {})
+        entry = self._manifest.get(name)
+        if entry is not None:
+            name = entry['hashed_name']
+        return super(ManifestStaticFilesStorage, self).url(name)
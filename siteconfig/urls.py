@@ -1,14 +1,30 @@
+from django.conf import settings
 from django.conf.urls.defaults import patterns, include, url
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import RegexURLResolver
 import twist.urls
 
-# Uncomment the next two lines to enable the admin:
-from django.contrib import admin
-admin.autodiscover()
+# The admin is mounted according to ADMIN_MODE, see deploy_envs/defaults.py
+if settings.ADMIN_MODE == 'enabled':
+    from django.contrib import admin
+    admin.autodiscover()
+    admin_patterns = patterns('',
+        url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
+        url(r'^admin/', include(admin.site.urls)),
+    )
+elif settings.ADMIN_MODE == 'lazy':
+    # Unlike include(), the resolver imports the URLconf when first used: by
+    # the first request under admin/, or the first reverse()
+    admin_patterns = patterns('',
+        RegexURLResolver(r'^admin/', 'siteconfig.admin_urls'),
+    )
+elif settings.ADMIN_MODE == 'disabled':
+    admin_patterns = patterns('')
+else:
+    raise ImproperlyConfigured("ADMIN_MODE must be 'enabled', 'lazy' or"
+                               " 'disabled', not %r" % settings.ADMIN_MODE)
 
-urlpatterns = patterns('',
-    # Examples:
-
-    url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
-    url(r'^admin/', include(admin.site.urls)),
+urlpatterns = admin_patterns + patterns('',
+    url(r'^_stats/$', 'siteconfig.views.request_stats'),
     url(r'', include(twist.urls)),
 )
@@ -0,0 +1,19 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotFound
+
+from siteconfig import middleware
+
+def request_stats(request):
+    """
+    Returns the request statistics of the process, as JSON. Only the staff and
+    the INTERNAL_IPS may see them; the others get a 404.
+    """
+    user = getattr(request, 'user', None)
+    if not ((user is not None and user.is_staff)
+            or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+        return HttpResponseNotFound()
+    return HttpResponse(json.dumps(middleware.snapshot(), indent=1,
+                                   sort_keys=True),
+                        content_type='application/json')
@@ -0,0 +1,62 @@
+"""
+Template warmup.
+
+With cached template loaders, each process reads and parses a template the
+first time it is rendered. warm_templates() loads every template the loaders
+can find beforehand, so that it is done once when siteconfig.wsgi sets up
+Django (on the first request of the process, or in the master process when
+preloading) instead of during the first requests that render each template.
+"""
+
+import os
+import time
+
+from django.conf import settings
+from django.template import loader
+
+
+def template_dirs():
+    """
+    Returns the directories templates are searched in: TEMPLATE_DIRS, then the
+    "templates" directory of each installed app.
+    """
+    from django.template.loaders.app_directories import app_template_dirs
+    return list(settings.TEMPLATE_DIRS) + list(app_template_dirs)
+
+def find_templates():
+    """
+    Returns the names of every template in the template directories, in the
+    order they are searched. Hidden files are skipped.
+    """
+    names = []
+    seen = set()
+    for template_dir in template_dirs():
+        for root, dirs, files in os.walk(template_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, template_dir).replace(os.sep, '/')
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+    return names
+
+def warm_templates():
+    """
+    Loads every template found by find_templates(), and returns a list of
+    (name, seconds, error) tuples, where error is None or the exception raised
+    while loading the template (e.g. it is not a template, or uses a tag library
+    of an app that is not installed).
+    """
+    results = []
+    for name in find_templates():
+        start = time.time()
+        try:
+            loader.get_template(name)
+            error = None
+        except Exception as e:
+            error = e
+        results.append((name, time.time() - start, error))
+    return results
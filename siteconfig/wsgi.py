@@ -2,42 +2,124 @@
 WSGI File for TWIST.
 
 This file is intended to work with both Django 1.3 and 1.4, and will allow for
-configuration of development environment from Apache SetEnv directive.
+configuration of development environment and admin mode from Apache SetEnv
+directive (DJANGO_DEPLOY_ENV and DJANGO_ADMIN_MODE).
+
+Django is initialized only once per process, on the first request. Setting
+DJANGO_WSGI_PRELOAD=1 in the process environment initializes it as soon as this
+file is imported instead, so that a preforking server (e.g. gunicorn --preload)
+can warm up everything in the master and share it with its workers. Setting
+DJANGO_WSGI_PRELOAD=freeze also keeps what was loaded out of the reach of the
+garbage collector, so that the workers keep sharing it; see siteconfig.prefork
+and siteconfig/gunicorn_conf.py.
 """
 import os
+import threading
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "siteconfig.settings")
 
-def _setup_application(environ, start_response):
+_handler = None
+_handler_lock = threading.Lock()
+
+def _unknown_django_version(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['Cannot determine the correct Django version\n']
+
+def _get_handler(deploy_env, admin_mode=None):
     """
-    Retrieve the relevant information from the WSGI environment and sets up the
-    Django application.
+    Initialize Django for the given deploy environment and admin mode, and
+    return its WSGI handler. With TEMPLATE_WARMUP, every template is compiled
+    too. Only the first call does any work; it is safe to call this from many
+    threads at the same time.
+    """
+    global _handler
+
+    if _handler is not None:
+        return _handler
+
+    with _handler_lock:
+        if _handler is not None:
+            return _handler
+
+        os.environ['DJANGO_DEPLOY_ENV'] = deploy_env
+        if admin_mode:
+            os.environ['DJANGO_ADMIN_MODE'] = admin_mode
+
+        # See if Django version is 1.4 or 1.3
+        import django
+
+        if django.VERSION[1] == 4:
+            # This is Django (probably) version 1.4
+            from django.core.wsgi import get_wsgi_application
+            handler = get_wsgi_application()
+
+        elif django.VERSION[1] == 3:
+            import django.core.handlers.wsgi
+            handler = django.core.handlers.wsgi.WSGIHandler()
 
-    This function will (hopefully) be executed only once in the lifetime of the
-    WSGI process, to initialize Django and reassign the 'application' variable.
+        else:
+            handler = _unknown_django_version
+
+        if handler is not _unknown_django_version:
+            from django.conf import settings
+            if getattr(settings, 'TEMPLATE_WARMUP', False):
+                # The first request of the process waits for it instead of
+                # every request compiling the templates it uses
+                from siteconfig.warmup import warm_templates
+                warm_templates()
+
+        _handler = handler
+
+    return _handler
+
+def preload():
     """
+    Initialize Django and load everything the first request would otherwise
+    load: the settings, the middleware, the models of every installed app and
+    the URLconf, which runs admin.autodiscover(), and the templates (see
+    _get_handler()). The database connections opened meanwhile are closed, so
+    that the workers of a preforking server don't inherit them.
 
-    # Retrieve the Deploy environment from the WSGI environment
-    deploy_env = environ.get('DJANGO_DEPLOY_ENV', 'dev')
-    os.environ['DJANGO_DEPLOY_ENV'] = deploy_env
+    The deploy environment is taken from the process environment, since there
+    is no WSGI environment yet.
+    """
+    handler = _get_handler(os.environ.get('DJANGO_DEPLOY_ENV', 'dev'))
+    if getattr(handler, '_request_middleware', False) is None:
+        handler.load_middleware()
 
-    # See if Django version is 1.4 or 1.3
-    import django
+    from django.conf import settings
+    from django.db.models.loading import get_models
+    from django.core.urlresolvers import get_resolver
 
-    if django.VERSION[1] == 4:
-        # This is Django (probably) version 1.4
-        from django.core.wsgi import get_wsgi_application
-        application = get_wsgi_application()
+    get_models()
+    get_resolver(settings.ROOT_URLCONF).url_patterns
 
-    elif django.VERSION[1] == 3:
-        import django.core.handlers.wsgi
-        application = django.core.handlers.wsgi.WSGIHandler()
+    from siteconfig.prefork import close_connections
+    close_connections()
 
-    else:
-        start_response('200 OK', [('Content-Type', 'text/plain')])
-        return ['Cannot determine the correct Django version\n']
+def application(environ, start_response):
+    """
+    Retrieve the Deploy environment and admin mode from the WSGI environment on
+    the first request, set up the Django application and pass the request to
+    it.
+    """
+    handler = _handler
+    if handler is None:
+        handler = _get_handler(environ.get('DJANGO_DEPLOY_ENV', 'dev'),
+                               environ.get('DJANGO_ADMIN_MODE'))
+    return handler(environ, start_response)
 
-    # Pass the present request to the just initialized application.
-    return application(environ, start_response)
+if os.environ.get('DJANGO_WSGI_PRELOAD', '') not in ('', '0'):
+    preload()
+    if os.environ['DJANGO_WSGI_PRELOAD'] == 'freeze':
+        from siteconfig.prefork import freeze
+        freeze()
 
-application = _setup_application
+    # gunicorn calls post_fork() from siteconfig/gunicorn_conf.py
+    try:
+        import uwsgidecorators
+    except ImportError:
+        pass
+    else:
+        from siteconfig.prefork import post_fork
+        uwsgidecorators.postfork(post_fork)
@@ -0,0 +1,81 @@
+import shlex
+import sys
+import time
+import traceback
+from optparse import make_option
+
+from django.core.management import get_commands, load_command_class
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    args = '"<command> [options]" ...'
+    help = ('Runs the given management commands one after another in this'
+            ' process, so that Django starts only once. Each command and its'
+            ' options are given as one argument. Stops at the first command'
+            ' that fails.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--file', dest='file', default=None,
+                    help='Read the commands from a file, one per line, after'
+                         ' those given as arguments ("-" for the standard'
+                         ' input).'),
+    )
+
+    def handle(self, *commands, **options):
+        commands = list(commands)
+        if options['file']:
+            if options['file'] == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(options['file']) as f:
+                    lines = f.readlines()
+            commands.extend(line.strip() for line in lines
+                            if line.strip() and not line.startswith('#'))
+        if not commands:
+            raise CommandError('No command given.')
+
+        for number, command_line in enumerate(commands, 1):
+            self.stdout.write('==> [%d/%d] %s\n'
+                              % (number, len(commands), command_line))
+            self.stdout.flush()
+            start = time.time()
+            status = self.run_command(command_line)
+            self.stdout.write('<== [%d/%d] %s: %s in %.2f seconds\n'
+                              % (number, len(commands), command_line,
+                                 'ok' if status == 0 else 'failed (%s)'
+                                 % status, time.time() - start))
+            if status != 0:
+                if number < len(commands):
+                    self.stdout.write('Not run: %s\n'
+                                      % ', '.join(commands[number:]))
+                raise CommandError('"%s" failed.' % command_line)
+
+    def run_command(self, command_line):
+        """
+        Runs the given command line as manage.py would, and returns its exit
+        status.
+        """
+        argv = shlex.split(command_line)
+        name = argv[0]
+        try:
+            app_name = get_commands()[name]
+        except KeyError:
+            self.stderr.write('Unknown command: %r\n' % name)
+            return 1
+        if isinstance(app_name, BaseCommand):
+            command = app_name
+        else:
+            command = load_command_class(app_name, name)
+
+        try:
+            command.run_from_argv(['manage.py'] + argv)
+        except SystemExit as e:
+            # Commands exit on errors, e.g. a CommandError
+            if e.code in (None, 0):
+                return 0
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            self.stderr.write(traceback.format_exc())
+            return 1
+        return 0
@@ -0,0 +1,257 @@
+import httplib
+import json
+import math
+import threading
+import time
+from optparse import make_option
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.core.management.base import NoArgsCommand, CommandError
+
+from siteconfig import wsgi
+
+# Named sets of URLs for --urls. Any other name is taken as a URL.
+URL_SETS = {
+    'index': ['/'],
+    'admin': ['/admin/'],
+    'static': ['%sadmin/css/base.css'],  # % STATIC_URL
+}
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values lie,
+    by the nearest-rank method.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def _application():
+    """
+    The WSGI application of the site, serving static files as runserver does.
+    """
+    return StaticFilesHandler(wsgi.application)
+
+def _in_process_request(application, url):
+    """
+    Makes a request by calling the WSGI application directly. Returns whether
+    it answered 200.
+    """
+    path, sep, query = url.partition('?')
+    environ = {
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'DJANGO_DEPLOY_ENV': settings.DJANGO_DEPLOY_ENV,
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None:
+                       statuses.append(status))
+    try:
+        for chunk in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return statuses[0].startswith('200')
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _Server(object):
+    """
+    The WSGI application served by a threaded wsgiref server on a free local
+    port, in a background thread.
+    """
+
+    def __init__(self, application):
+        self.httpd = make_server('127.0.0.1', 0, application,
+                                 server_class=_ThreadingWSGIServer,
+                                 handler_class=_QuietHandler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, url):
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            conn.request('GET', url)
+            response = conn.getresponse()
+            response.read()
+            return response.status == 200
+        finally:
+            conn.close()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_level(request, url, concurrency, requests):
+    """
+    Makes the given number of requests to the URL from concurrent threads.
+    Returns a dict with the requests per second, the p50, p95 and p99
+    latencies in milliseconds and the number of errors.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                ok = request(url)
+            except Exception:
+                ok = False
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    latencies.sort()
+    return {
+        'rps': requests / seconds if seconds else 0.0,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'errors': errors[0],
+    }
+
+
+class Command(NoArgsCommand):
+    help = ('Measures the throughput and latency of the WSGI application, by'
+            ' calling it in this process and through a local threaded HTTP'
+            ' server, at several concurrency levels.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--urls', dest='urls', default='index,admin,static',
+                    help='Comma separated URLs or URL sets (%s).'
+                         % ', '.join(sorted(URL_SETS))),
+        make_option('--concurrency', dest='concurrency', default='1,4,16',
+                    help='Comma separated numbers of concurrent clients.'),
+        make_option('--requests', type='int', dest='requests', default=200,
+                    help='Requests per URL and concurrency level.'),
+        make_option('--mode', dest='modes', default='inprocess,server',
+                    help='Comma separated modes: inprocess, server.'),
+        make_option('--save-baseline', dest='save_baseline', metavar='FILE',
+                    help='Save the results to a JSON file.'),
+        make_option('--compare', dest='compare', metavar='FILE',
+                    help='Compare the results with a saved baseline.'),
+        make_option('--threshold', type='float', dest='threshold', default=10,
+                    help='Percentage by which the throughput may drop, or the'
+                         ' p95 latency grow, before --compare fails.'),
+    )
+
+    def get_urls(self, names):
+        urls = []
+        for name in names.split(','):
+            for url in URL_SETS.get(name, [name]):
+                urls.append(url.replace('%s', settings.STATIC_URL))
+        return urls
+
+    def handle_noargs(self, **options):
+        urls = self.get_urls(options['urls'])
+        levels = [int(c) for c in options['concurrency'].split(',')]
+        modes = options['modes'].split(',')
+        application = _application()
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = {}
+        regressions = []
+        self.stdout.write('%-10s %-32s %5s %9s %9s %9s %9s %7s\n'
+                          % ('mode', 'url', 'conc', 'req/s', 'p50 ms',
+                             'p95 ms', 'p99 ms', 'errors'))
+        for mode in modes:
+            if mode == 'inprocess':
+                server = None
+                request = lambda url: _in_process_request(application, url)
+            elif mode == 'server':
+                server = _Server(application)
+                request = server.request
+            else:
+                raise CommandError('Unknown mode: %s' % mode)
+
+            try:
+                for url in urls:
+                    # Warm up: the first request loads the application
+                    request(url)
+                    for level in levels:
+                        key = '%s %s %d' % (mode, url, level)
+                        result = run_level(request, url, level,
+                                           options['requests'])
+                        results[key] = result
+                        self.stdout.write(
+                            '%-10s %-32s %5d %9.1f %9.2f %9.2f %9.2f %7d'
+                            % (mode, url, level, result['rps'], result['p50'],
+                               result['p95'], result['p99'], result['errors']))
+                        if baseline and key in baseline:
+                            change = self.compare(result, baseline[key],
+                                                  options['threshold'])
+                            self.stdout.write('  ' + change)
+                            if 'REGRESSION' in change:
+                                regressions.append(key)
+                        self.stdout.write('\n')
+            finally:
+                if server is not None:
+                    server.close()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+            self.stdout.write('\nBaseline saved to %s\n'
+                              % options['save_baseline'])
+
+        if regressions:
+            raise CommandError('%d results regressed more than %.0f%% from'
+                               ' the baseline: %s'
+                               % (len(regressions), options['threshold'],
+                                  ', '.join(regressions)))
+
+    def compare(self, result, base, threshold):
+        """
+        Returns the change of the throughput and p95 latency from the baseline,
+        marked as a regression if either got worse by more than the threshold
+        percentage.
+        """
+        def change(key):
+            if not base[key]:
+                return 0.0
+            return (result[key] / base[key] - 1) * 100
+
+        rps_change, p95_change = change('rps'), change('p95')
+        text = 'req/s %+.0f%%, p95 %+.0f%%' % (rps_change, p95_change)
+        if rps_change < -threshold or p95_change > threshold:
+            text += ' REGRESSION'
+        return text
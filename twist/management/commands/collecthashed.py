@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import NoArgsCommand
+
+from siteconfig.static_manifest import collect_static
+
+
+class Command(NoArgsCommand):
+    help = ('Collects the static files that changed since the last run to'
+            ' STATIC_ROOT, under their plain and content-hashed names, and'
+            ' removes the outputs of the files that changed or are gone.')
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def log(message):
+            if verbosity >= 2:
+                self.stdout.write(message + '\n')
+
+        start = time.time()
+        result = collect_static(log=log)
+        if verbosity >= 1:
+            self.stdout.write('%d copied, %d unchanged, %d removed in %.2f'
+                              ' seconds\n'
+                              % (len(result['copied']),
+                                 len(result['unchanged']),
+                                 len(result['pruned']), time.time() - start))
@@ -0,0 +1,170 @@
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import get_apps, get_models
+
+# Name of the lock taken in the database
+LOCK_NAME = 'twist.dbupdate'
+
+@contextmanager
+def file_lock(path, waiting):
+    """
+    Holds an exclusive lock on the given file, calling waiting() first if
+    another process holds it.
+    """
+    with open(path, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            waiting()
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+@contextmanager
+def database_lock(database, waiting):
+    """
+    Holds a lock on the given database, which excludes every process updating
+    it, whatever host it runs on, calling waiting() first if another process
+    holds it. SQLite databases are locked with a file next to the database,
+    PostgreSQL and MySQL databases with their advisory locks, which are
+    released if the process dies.
+    """
+    connection = connections[database]
+    vendor = connection.vendor
+
+    if vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        if not name or name == ':memory:':
+            # Private to this process
+            yield
+        else:
+            with file_lock(name + '.dbupdate-lock', waiting):
+                yield
+        return
+
+    cursor = connection.cursor()
+    if vendor == 'postgresql':
+        # Advisory locks are per database, and identified by a signed 64 bit
+        # integer
+        key = int(hashlib.md5(LOCK_NAME).hexdigest()[:15], 16)
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        if not cursor.fetchone()[0]:
+            waiting()
+            cursor.execute('SELECT pg_advisory_lock(%s)', [key])
+        try:
+            yield
+        finally:
+            connection.cursor().execute('SELECT pg_advisory_unlock(%s)', [key])
+    elif vendor == 'mysql':
+        # Named locks are per server, not per database
+        name = '%s.%s' % (connection.settings_dict['NAME'], LOCK_NAME)
+        cursor.execute('SELECT GET_LOCK(%s, 0)', [name])
+        acquired = cursor.fetchone()[0]
+        if not acquired:
+            waiting()
+        while not acquired:
+            cursor.execute('SELECT GET_LOCK(%s, 60)', [name])
+            acquired = cursor.fetchone()[0]
+        try:
+            yield
+        finally:
+            connection.cursor().execute('SELECT RELEASE_LOCK(%s)', [name])
+    else:
+        raise CommandError('Cannot lock a %s database. Give a lock file shared'
+                           ' by the hosts with --lock.' % vendor)
+
+def pending_work(database=DEFAULT_DB_ALIAS):
+    """
+    Returns the tables syncdb would create for the apps without migrations,
+    and the South migrations not applied yet, as (app label, migration name).
+    """
+    from south.migration import all_migrations
+    from south.models import MigrationHistory
+
+    connection = connections[database]
+    tables = set(connection.introspection.table_names())
+    migrations = list(all_migrations())
+    migrated_apps = set(m.app_label() for m in migrations)
+
+    missing_tables = []
+    for app in get_apps():
+        for model in get_models(app, include_auto_created=True):
+            opts = model._meta
+            if (opts.app_label in migrated_apps or not opts.managed
+                    or opts.proxy or opts.db_table in tables):
+                continue
+            missing_tables.append(opts.db_table)
+
+    if MigrationHistory._meta.db_table in tables:
+        applied = set(MigrationHistory.objects.using(database)
+                      .values_list('app_name', 'migration'))
+    else:
+        applied = set()
+    pending = [(migration.app_label(), migration.name())
+               for app_migrations in migrations
+               for migration in app_migrations
+               if (migration.app_label(), migration.name()) not in applied]
+    return sorted(set(missing_tables)), pending
+
+
+class Command(NoArgsCommand):
+    help = ('Runs syncdb and migrate, only if there is something to do, while'
+            ' holding a lock on the database so that two deploys never'
+            ' migrate it at the same time.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--fake', action='store_true', dest='fake', default=False,
+                    help='Mark the migrations as applied without running'
+                         ' them.'),
+        make_option('--all', action='store_true', dest='migrate_all',
+                    default=False,
+                    help='Create the tables of the migrated apps too with'
+                         ' syncdb (with --fake, for the first setup).'),
+        make_option('--lock', dest='lock', default=None,
+                    help='Lock file to use instead of a lock in the'
+                         ' database.'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to update.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        database = options['database']
+
+        def waiting():
+            if verbosity:
+                self.stdout.write('Waiting for another update of the'
+                                  ' database to finish...\n')
+
+        if options['lock']:
+            lock = file_lock(options['lock'], waiting)
+        else:
+            lock = database_lock(database, waiting)
+        with lock:
+            # Checked with the lock held, in case it was just done
+            self.update(database, options['fake'], options['migrate_all'],
+                        verbosity)
+
+    def update(self, database, fake, migrate_all, verbosity):
+        try:
+            missing_tables, pending = pending_work(database)
+        except ImportError as e:
+            raise CommandError('South is not available: %s' % e)
+
+        if not missing_tables and not pending and not migrate_all:
+            if verbosity:
+                self.stdout.write('The database is up to date.\n')
+            return
+
+        if verbosity:
+            self.stdout.write('%d tables to create, %d migrations to apply.\n'
+                              % (len(missing_tables), len(pending)))
+        call_command('syncdb', interactive=False, verbosity=verbosity,
+                     database=database, migrate_all=migrate_all)
+        call_command('migrate', fake=fake, verbosity=verbosity,
+                     database=database, interactive=False)
@@ -0,0 +1,56 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from siteconfig.prefork import memory_usage, find_processes
+
+
+class Command(NoArgsCommand):
+    help = ('Reports the shared and private memory of the application server'
+            ' processes, to tell how many workers fit in the memory of the'
+            ' host.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--match', dest='match', default='wsgi',
+                    help='Report the processes whose command line contains'
+                         ' this string.'),
+        make_option('--pids', dest='pids', default=None,
+                    help='Comma separated ids of the processes to report,'
+                         ' instead of --match.'),
+    )
+
+    def handle_noargs(self, **options):
+        if not os.path.isdir('/proc'):
+            raise CommandError('The memory report needs a /proc filesystem.')
+
+        if options['pids']:
+            pids = [int(pid) for pid in options['pids'].split(',')]
+        else:
+            pids = find_processes(options['match'])
+        if not pids:
+            raise CommandError('No process found.')
+
+        self.stdout.write('%8s %10s %10s %10s %10s\n'
+                          % ('pid', 'rss MB', 'shared MB', 'private MB',
+                             'pss MB'))
+        totals = dict.fromkeys(('rss', 'shared', 'private', 'pss'), 0)
+        for pid in pids:
+            try:
+                usage = memory_usage(pid)
+            except (IOError, OSError) as e:
+                self.stderr.write('%8d %s\n' % (pid, e))
+                continue
+            for key in totals:
+                totals[key] += usage[key]
+            self.stdout.write('%8d %10.1f %10.1f %10.1f %10.1f\n'
+                              % (pid, usage['rss'] / 1024.0,
+                                 usage['shared'] / 1024.0,
+                                 usage['private'] / 1024.0,
+                                 usage['pss'] / 1024.0))
+        # The sum of the PSS is what the processes really use together
+        self.stdout.write('%8s %10.1f %10.1f %10.1f %10.1f\n'
+                          % ('total', totals['rss'] / 1024.0,
+                             totals['shared'] / 1024.0,
+                             totals['private'] / 1024.0,
+                             totals['pss'] / 1024.0))
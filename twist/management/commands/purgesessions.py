@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import NoArgsCommand
+from django.db import router, transaction
+from django.utils import timezone
+
+
+class Command(NoArgsCommand):
+    help = ('Deletes the expired sessions from the database in small batches,'
+            ' so that the session table is never locked for long.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500,
+                    help='Number of sessions deleted per transaction.'),
+        make_option('--pause', type='float', dest='pause', default=0.1,
+                    help='Seconds to wait between batches.'),
+    )
+
+    def handle_noargs(self, **options):
+        using = router.db_for_write(Session)
+        now = timezone.now()
+        total = 0
+
+        while True:
+            with transaction.commit_on_success(using=using):
+                keys = list(Session.objects.using(using)
+                            .filter(expire_date__lt=now)
+                            .values_list('session_key', flat=True)
+                            [:options['batch_size']])
+                if keys:
+                    Session.objects.using(using).filter(
+                        session_key__in=keys).delete()
+            if not keys:
+                break
+            total += len(keys)
+            time.sleep(options['pause'])
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Deleted %d expired sessions.\n' % total)
@@ -0,0 +1,56 @@
+import os
+import pprint
+import subprocess
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from siteconfig import settings as site_settings
+from siteconfig.deploy_envs import _compiler, _helper
+
+# Measures how long a fresh process takes to import the settings
+_COLD_LOAD_SCRIPT = ('import time; start = time.time(); '
+                     'import siteconfig.settings; '
+                     'print time.time() - start')
+
+
+class Command(NoArgsCommand):
+    help = ('Shows the resolved settings of the current deploy environment and'
+            ' how long it took to load them.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--compare', action='store_true', dest='compare',
+                    default=False,
+                    help='Also time loading the settings in a new process,'
+                         ' with and without the frozen snapshot.'),
+    )
+
+    def cold_load_time(self, use_snapshot):
+        environ = dict(os.environ)
+        environ['DJANGO_SETTINGS_SNAPSHOT'] = '1' if use_snapshot else '0'
+        output = subprocess.Popen([sys.executable, '-c', _COLD_LOAD_SCRIPT],
+                                  cwd=_helper.PROJECT_DIR, env=environ,
+                                  stdout=subprocess.PIPE).communicate()[0]
+        return float(output)
+
+    def handle_noargs(self, **options):
+        for name in sorted(dir(site_settings)):
+            if name == name.upper() and not name.startswith('_'):
+                value = pprint.pformat(getattr(site_settings, name))
+                self.stdout.write('%s = %s\n' % (name, value))
+
+        load = _compiler.LAST_LOAD
+        self.stdout.write('\nDeploy environment "%s" %s in %.2f ms.\n'
+                          % (load['deploy_env'],
+                             'loaded from its snapshot' if load['from_snapshot']
+                             else 'resolved from its sources',
+                             load['seconds'] * 1000))
+
+        if options['compare']:
+            # The first run makes sure the snapshot is up to date
+            self.cold_load_time(True)
+            for use_snapshot in (False, True):
+                self.stdout.write('Cold load %s the snapshot: %.2f ms\n'
+                                  % ('with' if use_snapshot else 'without',
+                                     self.cold_load_time(use_snapshot) * 1000))
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from siteconfig.db_backends.sqlite3_tuned.base import apply_tuning
+
+# Rows in the table the workers read and write
+_ROWS = 1000
+
+def _worker(path, tuned, seconds, write_ratio, results):
+    """
+    Reads and updates random rows of the benchmark database for the given
+    number of seconds, and puts the operation counts in the results queue.
+    """
+    conn = sqlite3.connect(path)
+    if tuned:
+        apply_tuning(conn)
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        key = random.randint(1, _ROWS)
+        try:
+            if random.random() < write_ratio:
+                conn.execute('UPDATE bench SET value = value + 1 WHERE id = ?',
+                             (key,))
+                conn.commit()
+                counts['writes'] += 1
+            else:
+                conn.execute('SELECT value FROM bench WHERE id = ?',
+                             (key,)).fetchone()
+                counts['reads'] += 1
+        except sqlite3.OperationalError:
+            # database is locked
+            conn.rollback()
+            counts['errors'] += 1
+    conn.close()
+    results.put(counts)
+
+
+class Command(NoArgsCommand):
+    help = ('Measures the read/write throughput of concurrent processes on a'
+            ' SQLite database, with SQLite\'s defaults and with the tuning of'
+            ' siteconfig.db_backends.sqlite3_tuned.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of concurrent worker processes.'),
+        make_option('--seconds', type='float', dest='seconds', default=3,
+                    help='Duration of each run.'),
+        make_option('--write-ratio', type='float', dest='write_ratio',
+                    default=0.2,
+                    help='Fraction of the operations that are writes.'),
+    )
+
+    def run(self, tuned, workers, seconds, write_ratio):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'bench.sqlite3')
+            conn = sqlite3.connect(path)
+            conn.execute('CREATE TABLE bench (id INTEGER PRIMARY KEY,'
+                         ' value INTEGER)')
+            conn.executemany('INSERT INTO bench VALUES (?, 0)',
+                             ((i,) for i in range(1, _ROWS + 1)))
+            conn.commit()
+            conn.close()
+
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(
+                target=_worker,
+                args=(path, tuned, seconds, write_ratio, results))
+                for i in range(workers)]
+            for p in processes:
+                p.start()
+            totals = {'reads': 0, 'writes': 0, 'errors': 0}
+            for p in processes:
+                for k, v in results.get().items():
+                    totals[k] += v
+            for p in processes:
+                p.join()
+        finally:
+            shutil.rmtree(tmp_dir)
+        return totals
+
+    def handle_noargs(self, **options):
+        workers = options['workers']
+        seconds = options['seconds']
+
+        self.stdout.write('%d workers, %.0f%% writes, %.1f seconds per run\n\n'
+                          % (workers, options['write_ratio'] * 100, seconds))
+        self.stdout.write('%-8s %12s %12s %12s\n'
+                          % ('mode', 'reads/s', 'writes/s', 'errors'))
+        for tuned in (False, True):
+            totals = self.run(tuned, workers, seconds, options['write_ratio'])
+            self.stdout.write('%-8s %12.0f %12.0f %12d\n'
+                              % ('tuned' if tuned else 'default',
+                                 totals['reads'] / seconds,
+                                 totals['writes'] / seconds,
+                                 totals['errors']))
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from siteconfig.startup import profile_in_subprocess
+
+
+class Command(NoArgsCommand):
+    help = ('Profiles the startup of a new process of the current deploy'
+            ' environment: the time of each phase and the modules slowest to'
+            ' import. Fails if it takes longer than STARTUP_BUDGET seconds.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=20,
+                    help='Number of modules to list.'),
+        make_option('--runs', type='int', dest='runs', default=3,
+                    help='Number of processes to profile. The fastest one is'
+                         ' reported.'),
+        make_option('--budget', type='float', dest='budget', default=None,
+                    help='Startup budget in seconds. Defaults to the'
+                         ' STARTUP_BUDGET setting.'),
+    )
+
+    def handle_noargs(self, **options):
+        budget = options['budget']
+        if budget is None:
+            budget = getattr(settings, 'STARTUP_BUDGET', None)
+
+        result = profile_in_subprocess(settings.DJANGO_DEPLOY_ENV,
+                                       options['runs'])
+
+        self.stdout.write('%-20s %9s\n' % ('phase', 'ms'))
+        for name, seconds in result['phases']:
+            self.stdout.write('%-20s %9.1f\n' % (name, seconds * 1000))
+        self.stdout.write('%-20s %9.1f\n\n' % ('total',
+                                               result['total'] * 1000))
+
+        self.stdout.write('%-50s %9s %9s\n' % ('module', 'own ms',
+                                               'total ms'))
+        for name, cumulative, own in result['modules'][:options['limit']]:
+            self.stdout.write('%-50s %9.1f %9.1f\n'
+                              % (name, own * 1000, cumulative * 1000))
+
+        if budget is not None and result['total'] > budget:
+            raise CommandError('Startup took %.2f seconds, over the budget of'
+                               ' %.2f seconds.' % (result['total'], budget))
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from siteconfig.warmup import warm_templates
+
+
+class Command(NoArgsCommand):
+    help = ('Compiles every template found in the template directories and'
+            ' lists them by compile time, the slowest first.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=0,
+                    help='Only list this many templates.'),
+        make_option('--errors', action='store_true', dest='errors',
+                    default=False,
+                    help='Also list the templates that failed to compile.'),
+    )
+
+    def handle_noargs(self, **options):
+        results = warm_templates()
+        compiled = sorted((r for r in results if r[2] is None),
+                          key=lambda r: r[1], reverse=True)
+        failed = [r for r in results if r[2] is not None]
+        total = sum(r[1] for r in results)
+
+        self.stdout.write('%d templates compiled in %.1f ms, %d failed\n\n'
+                          % (len(compiled), total * 1000, len(failed)))
+        self.stdout.write('%10s  %s\n' % ('ms', 'template'))
+        for name, seconds, error in compiled[:options['limit'] or None]:
+            self.stdout.write('%10.2f  %s\n' % (seconds * 1000, name))
+
+        if options['errors'] and failed:
+            self.stdout.write('\nFailed:\n')
+            for name, seconds, error in failed:
+                self.stdout.write('  %s: %s: %s\n'
+                                  % (name, error.__class__.__name__, error))
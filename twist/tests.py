@@ -5,7 +5,11 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import os
+
+from django.conf import settings
 from django.test import TestCase
+from django.test.utils import override_settings
 
 
 class SimpleTest(TestCase):
@@ -14,3 +18,1293 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class WSGITest(TestCase):
+    def test_handler_is_created_once(self):
+        """
+        Tests that Django is initialized by the first request only.
+        """
+        from wsgiref.util import setup_testing_defaults
+        from siteconfig import wsgi
+
+        environ = {'DJANGO_DEPLOY_ENV': settings.DJANGO_DEPLOY_ENV}
+        setup_testing_defaults(environ)
+        statuses = []
+        body = wsgi.application(environ,
+                                lambda status, headers: statuses.append(status))
+
+        self.assertEqual(statuses, ['200 OK'])
+        self.assertTrue('TWIST' in ''.join(body))
+        self.assertTrue(wsgi._get_handler('other') is wsgi._handler)
+
+
+    def test_templates_are_warmed_up(self):
+        """
+        Tests that the templates are compiled when Django is initialized,
+        without preloading.
+        """
+        from siteconfig import warmup, wsgi
+
+        calls = []
+        old_handler, old_warm_templates = wsgi._handler, warmup.warm_templates
+        wsgi._handler = None
+        warmup.warm_templates = lambda: calls.append(True)
+        try:
+            with override_settings(TEMPLATE_WARMUP=True):
+                wsgi._get_handler(settings.DJANGO_DEPLOY_ENV)
+        finally:
+            wsgi._handler = old_handler
+            warmup.warm_templates = old_warm_templates
+        self.assertEqual(calls, [True])
+
+class SettingsCompilerTest(TestCase):
+    def test_disabled_apps_are_removed(self):
+        """
+        Tests that the disabled apps are removed from the app, middleware,
+        context processor and router lists.
+        """
+        import sys
+        import types
+        from siteconfig.deploy_envs import _compiler
+
+        module = types.ModuleType('siteconfig.deploy_envs.test_disabled')
+        module.DISABLED_APPS = ['django.contrib.messages']
+        sys.modules[module.__name__] = module
+        try:
+            resolved = _compiler.compile_settings('test_disabled')
+        finally:
+            del sys.modules[module.__name__]
+
+        self.assertFalse('django.contrib.messages' in resolved['INSTALLED_APPS'])
+        for name in _compiler.APP_FILTERED_SETTINGS:
+            self.assertTrue(isinstance(resolved[name], tuple))
+            for value in resolved[name]:
+                self.assertFalse(value.startswith('django.contrib.messages'))
+        self.assertTrue('django.contrib.auth' in resolved['INSTALLED_APPS'])
+
+
+class _StandInConnection(object):
+    """
+    Connection to the stand-in database server of ConnectionPoolTest.
+    """
+    def __init__(self, address):
+        import socket
+        self.socket = socket.create_connection(address)
+        self.closed = False
+
+    def close(self):
+        self.socket.close()
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        """
+        Starts a local server standing in for the database.
+        """
+        import SocketServer
+        import threading
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                self.request.recv(1)
+
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_pool(self, **kwargs):
+        from siteconfig.db_backends.pool import ConnectionPool
+        address = self.server.server_address
+        return ConnectionPool(lambda: _StandInConnection(address),
+                              check=lambda conn: not conn.closed, **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.get_pool()
+        for i in range(5):
+            conn = pool.get()
+            pool.put(conn)
+        self.assertEqual(pool.size(), 1)
+        pool.close()
+        self.assertEqual(pool.size(), 0)
+
+    def test_max_size(self):
+        from siteconfig.db_backends.pool import PoolTimeout
+        pool = self.get_pool(max_size=2, timeout=0.1)
+        conns = [pool.get(), pool.get()]
+        self.assertRaises(PoolTimeout, pool.get)
+        pool.put(conns[0])
+        self.assertTrue(pool.get() is conns[0])
+
+    def test_stale_connections_are_replaced(self):
+        pool = self.get_pool()
+        conn = pool.get()
+        conn.close()
+        pool.put(conn)
+        new_conn = pool.get()
+        self.assertFalse(new_conn is conn)
+        self.assertFalse(new_conn.closed)
+        self.assertEqual(pool.size(), 1)
+
+    def test_idle_connections_are_evicted(self):
+        pool = self.get_pool(min_size=1, max_idle=-1)
+        conns = [pool.get(), pool.get(), pool.get()]
+        for conn in conns:
+            pool.put(conn)
+        pool.put(pool.get())
+        self.assertEqual(pool.size(), 1)
+        self.assertEqual(len([c for c in conns if c.closed]), 2)
+
+    def test_fill(self):
+        pool = self.get_pool(min_size=2)
+        pool.fill()
+        self.assertEqual(pool.size(), 2)
+        conn = pool.get()
+        pool.fill()
+        self.assertEqual(pool.size(), 2)
+        pool.put(conn)
+
+    def test_forget(self):
+        pool = self.get_pool()
+        conn = pool.get()
+        pool.put(conn)
+        pool.forget()
+        self.assertEqual(pool.size(), 0)
+        self.assertFalse(conn.closed)
+        self.assertFalse(pool.get() is conn)
+
+
+class TunedSQLiteTest(TestCase):
+    def test_connections_are_tuned(self):
+        """
+        Tests that new connections of the tuned SQLite backend use the WAL
+        journal and the given tuning options.
+        """
+        import shutil
+        import tempfile
+        from siteconfig.db_backends.sqlite3_tuned.base import DatabaseWrapper
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            wrapper = DatabaseWrapper({
+                'NAME': os.path.join(tmp_dir, 'tuned.sqlite3'),
+                'OPTIONS': {},
+                'TUNING': {'SYNCHRONOUS': 'OFF'},
+            }, 'tuned')
+            cursor = wrapper.cursor()
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            wrapper.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TieredCacheTest(TestCase):
+    CACHES = {
+        'default': {
+            'BACKEND': 'siteconfig.cache_backends.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {'MAX_ENTRIES': 2, 'LOCAL_TIMEOUT': 30},
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tiered-cache-test',
+        },
+    }
+
+    def get_cache(self):
+        from django.core.cache import get_cache
+        with override_settings(CACHES=self.CACHES):
+            cache = get_cache('default')
+            cache.shared.clear()
+        return cache
+
+    def test_lru_eviction(self):
+        cache = self.get_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache.local), 2)
+        self.assertEqual(cache.local.get(cache.make_key('b')), None)
+        # Evicted entries are still found in the shared tier
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_local_entries_expire(self):
+        cache = self.get_cache()
+        cache.local_timeout = -1
+        cache.set('a', 1)
+        cache.shared.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_values_are_not_shared(self):
+        cache = self.get_cache()
+        cache.set('a', [1])
+        cache.get('a').append(2)
+        self.assertEqual(cache.get('a'), [1])
+
+    def test_import_before_django_cache(self):
+        """
+        Tests that siteconfig.cache can be imported first in a new process,
+        while Django sets up the default cache, which is a TieredCache.
+        """
+        import subprocess
+        import sys
+        from siteconfig.startup import PROJECT_DIR
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='siteconfig.settings')
+        subprocess.check_call([sys.executable, '-c', 'import siteconfig.cache'],
+                              cwd=PROJECT_DIR, env=env)
+
+    def test_versioned_page(self):
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from siteconfig import cache
+
+        calls = []
+        @cache.cache_versioned_page(60)
+        def view(request):
+            calls.append(request)
+            return HttpResponse('page %d' % len(calls))
+
+        cache._caches['default'] = self.get_cache()
+        old_version = cache._deploy_version
+        try:
+            cache._deploy_version = '1'
+            request = RequestFactory().get('/page/')
+            self.assertEqual(view(request).content, 'page 1')
+            self.assertEqual(view(request).content, 'page 1')
+            self.assertEqual(view(RequestFactory().get('/page/?a')).content,
+                             'page 2')
+            cache._deploy_version = '2'
+            self.assertEqual(view(request).content, 'page 3')
+        finally:
+            cache._deploy_version = old_version
+            del cache._caches['default']
+
+
+class WriteBehindSessionTest(TestCase):
+    def setUp(self):
+        from siteconfig import sessions
+        self.sessions = sessions
+        self.cache = sessions.get_cache_instance(settings.SESSION_CACHE_ALIAS)
+
+    def tearDown(self):
+        self.sessions.write_behind_queue.flush()
+        self.cache.clear()
+
+    def test_writes_are_deferred(self):
+        from django.contrib.sessions.models import Session
+
+        store = self.sessions.SessionStore()
+        store['user'] = 'twist'
+        store.save()
+        key = store.session_key
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertEqual(self.sessions.SessionStore(key)['user'], 'twist')
+
+        self.sessions.write_behind_queue.flush()
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+
+        # Sessions missing from the cache are loaded from the database
+        self.cache.clear()
+        self.assertEqual(self.sessions.SessionStore(key)['user'], 'twist')
+
+    def test_unchanged_sessions_are_not_saved(self):
+        store = self.sessions.SessionStore()
+        store['user'] = 'twist'
+        store.save()
+        self.sessions.write_behind_queue.flush()
+
+        store = self.sessions.SessionStore(store.session_key)
+        store['user'] = 'twist'
+        store.save()
+        self.assertEqual(
+            self.sessions.write_behind_queue.get(store.session_key), None)
+
+    def test_cache_must_be_shared_by_all_hosts(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        with self.settings(SESSION_CACHE_SINGLE_HOST=False):
+            self.assertRaises(ImproperlyConfigured, self.sessions.check_cache,
+                              'shared')
+            caches = dict(settings.CACHES, shared={
+                'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                'LOCATION': 'cache'})
+            with self.settings(CACHES=caches):
+                self.sessions.check_cache('shared')
+
+    def test_purge_expired_sessions(self):
+        import datetime
+        from django.contrib.sessions.models import Session
+        from django.core.management import call_command
+        from django.utils import timezone
+
+        past = timezone.now() - datetime.timedelta(days=1)
+        for i in range(5):
+            Session.objects.create(session_key='expired%d' % i,
+                                   session_data='', expire_date=past)
+        Session.objects.create(session_key='valid', session_data='',
+                               expire_date=past + datetime.timedelta(days=2))
+
+        call_command('purgesessions', batch_size=2, pause=0, verbosity=0)
+        self.assertEqual(list(Session.objects.values_list('session_key',
+                                                          flat=True)),
+                         ['valid'])
+
+
+class TemplateWarmupTest(TestCase):
+    def test_warm_templates(self):
+        from django.template import loader
+        from siteconfig.deploy_envs._helper import cached_template_loaders
+        from siteconfig.warmup import find_templates, warm_templates
+
+        self.assertTrue('admin/login.html' in find_templates())
+
+        old_loaders = loader.template_source_loaders
+        loader.template_source_loaders = None
+        try:
+            with override_settings(TEMPLATE_LOADERS=cached_template_loaders()):
+                results = warm_templates()
+                cached_loader = loader.template_source_loaders[0]
+        finally:
+            loader.template_source_loaders = old_loaders
+
+        self.assertEqual([r for r in results if r[2] is not None], [])
+        self.assertTrue('admin/login.html' in cached_loader.template_cache)
+
+
+class StaticManifestTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.contrib.staticfiles import finders
+        self.source_dir = tempfile.mkdtemp()
+        self.static_root = tempfile.mkdtemp()
+        self.settings = override_settings(
+            STATICFILES_DIRS=(self.source_dir,),
+            STATICFILES_FINDERS=(
+                'django.contrib.staticfiles.finders.FileSystemFinder',),
+            STATIC_ROOT=self.static_root)
+        self.settings.enable()
+        finders._finders.clear()
+
+    def tearDown(self):
+        import shutil
+        from django.contrib.staticfiles import finders
+        self.settings.disable()
+        finders._finders.clear()
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.static_root)
+
+    def write(self, name, content):
+        with open(os.path.join(self.source_dir, name), 'w') as f:
+            f.write(content)
+
+    def test_collect_static(self):
+        from siteconfig.static_manifest import (collect_static, load_manifest,
+                                                ManifestStaticFilesStorage)
+        self.write('a.css', 'a')
+        self.write('b.js', 'b')
+        self.assertEqual(sorted(collect_static()['copied']), ['a.css', 'b.js'])
+
+        manifest = load_manifest()
+        hashed_a = manifest['a.css']['hashed_name']
+        self.assertTrue(
+            os.path.exists(os.path.join(self.static_root, hashed_a)))
+        self.assertEqual(ManifestStaticFilesStorage().url('a.css'),
+                         settings.STATIC_URL + hashed_a)
+
+        result = collect_static()
+        self.assertEqual(result['copied'], [])
+        self.assertEqual(sorted(result['unchanged']), ['a.css', 'b.js'])
+
+        self.write('a.css', 'changed')
+        os.remove(os.path.join(self.source_dir, 'b.js'))
+        result = collect_static()
+        self.assertEqual(result['copied'], ['a.css'])
+        hashed_a = load_manifest()['a.css']['hashed_name']
+        self.assertEqual(sorted(os.listdir(self.static_root)),
+                         sorted(['a.css', hashed_a, 'staticfiles.json']))
+
+
+    def test_static_root_is_required(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from siteconfig.static_manifest import collect_static
+
+        self.write('a.css', 'a')
+        with override_settings(STATIC_ROOT=''):
+            self.assertRaises(ImproperlyConfigured, collect_static)
+
+class BenchTest(TestCase):
+    def test_percentile(self):
+        from twist.management.commands.bench import percentile
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    def test_bench_both_modes(self):
+        from StringIO import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('bench', urls='index', concurrency='1,2', requests=5,
+                     stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([(r[0], r[2]) for r in rows],
+                         [('inprocess', '1'), ('inprocess', '2'),
+                          ('server', '1'), ('server', '2')])
+        self.assertEqual([r[-1] for r in rows], ['0'] * 4)
+
+
+class StartupTest(TestCase):
+    def test_startup_profile(self):
+        """
+        Tests that the startup of a new process is profiled phase by phase,
+        with the modules imported along the way.
+        """
+        from siteconfig.startup import profile_in_subprocess
+
+        result = profile_in_subprocess(settings.DJANGO_DEPLOY_ENV)
+        self.assertEqual([name for name, seconds in result['phases']],
+                         ['settings', 'apps', 'middleware', 'admin discovery',
+                          'urlconf'])
+        self.assertAlmostEqual(result['total'],
+                               sum(seconds for name, seconds
+                                   in result['phases']))
+
+        modules = result['modules']
+        self.assertTrue(all(len(module) == 3 for module in modules))
+        names = [module[0] for module in modules]
+        for name in ('siteconfig.settings', 'twist.models',
+                     settings.ROOT_URLCONF):
+            self.assertTrue(name in names, '%s was not recorded' % name)
+        self.assertEqual(len(names), len(set(names)))
+        # The slowest first, by own time
+        self.assertEqual(modules, sorted(modules, key=lambda m: m[2],
+                                         reverse=True))
+
+
+    def test_startup_within_budget(self):
+        """
+        Tests that a new process starts within STARTUP_BUDGET seconds, when
+        the budget is enforced.
+        """
+        from siteconfig.startup import profile_in_subprocess
+
+        if not (settings.STARTUP_BUDGET_ENFORCED
+                or os.environ.get('STARTUP_BUDGET_ENFORCED') == '1'):
+            return
+        result = profile_in_subprocess(settings.DJANGO_DEPLOY_ENV, runs=3)
+        self.assertTrue(result['total'] <= settings.STARTUP_BUDGET,
+                        'Startup took %.2f seconds, over the budget of %.2f'
+                        % (result['total'], settings.STARTUP_BUDGET))
+
+class AdminModeTest(TestCase):
+    def tearDown(self):
+        from django.core.urlresolvers import clear_url_caches
+        import siteconfig.urls
+        reload(siteconfig.urls)
+        clear_url_caches()
+
+    def load_urlconf(self, admin_mode):
+        from django.core.urlresolvers import clear_url_caches
+        import siteconfig.urls
+        with override_settings(ADMIN_MODE=admin_mode):
+            reload(siteconfig.urls)
+        clear_url_caches()
+        return siteconfig.urls
+
+    def test_lazy_admin(self):
+        """
+        Tests that the lazy admin is only mounted as the name of its URLconf,
+        and that it is loaded to resolve the admin URLs.
+        """
+        from django.contrib import admin
+        from django.core.urlresolvers import resolve
+
+        urls = self.load_urlconf('lazy')
+        self.assertEqual(urls.urlpatterns[0].urlconf_name,
+                         'siteconfig.admin_urls')
+        match = resolve('/admin/', urls)
+        self.assertEqual(match.url_name, 'index')
+        self.assertEqual(match.namespace, admin.site.name)
+        self.assertEqual(resolve('/admin/doc/', urls).url_name,
+                         'django-admindocs-docroot')
+
+    def test_disabled_admin(self):
+        """
+        Tests that the admin is not mounted when disabled.
+        """
+        from django.core.urlresolvers import resolve, Resolver404
+
+        urls = self.load_urlconf('disabled')
+        self.assertRaises(Resolver404, resolve, '/admin/', urls)
+        self.assertEqual(resolve('/', urls).url_name, 'twist.views.index')
+
+
+class PreforkTest(TestCase):
+    def test_freeze(self):
+        """
+        Tests that freeze() keeps the loaded objects out of the full
+        collections.
+        """
+        import gc
+        from siteconfig.prefork import freeze, FULL_COLLECTION_THRESHOLD
+
+        threshold = gc.get_threshold()
+        try:
+            how = freeze()
+            if how == 'freeze':
+                self.assertTrue(gc.get_freeze_count() > 0)
+            else:
+                self.assertEqual(how, 'threshold')
+                self.assertTrue(gc.get_threshold()[2]
+                                >= FULL_COLLECTION_THRESHOLD)
+        finally:
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+            gc.set_threshold(*threshold)
+
+    def test_memory_usage(self):
+        """
+        Tests that the memory of a process is split in shared and private
+        memory.
+        """
+        from siteconfig.prefork import memory_usage
+
+        if not os.path.isdir('/proc'):
+            return
+        usage = memory_usage(os.getpid())
+        self.assertTrue(usage['private'] > 0)
+        self.assertEqual(usage['shared'] + usage['private'], usage['rss'])
+
+    def test_gunicorn_conf(self):
+        """
+        Tests that the gunicorn configuration preloads the application and
+        prepares the workers with post_fork().
+        """
+        from siteconfig import prefork
+
+        calls = []
+        old_environ, old_post_fork = dict(os.environ), prefork.post_fork
+        prefork.post_fork = lambda server, worker: calls.append(worker)
+        try:
+            from siteconfig import gunicorn_conf
+            self.assertEqual(os.environ['DJANGO_WSGI_PRELOAD'], 'freeze')
+            self.assertTrue(gunicorn_conf.preload_app)
+            gunicorn_conf.post_fork(None, 'worker')
+        finally:
+            prefork.post_fork = old_post_fork
+            os.environ.clear()
+            os.environ.update(old_environ)
+        self.assertEqual(calls, ['worker'])
+
+    def test_post_fork(self):
+        """
+        Tests that post_fork() drops the inherited connections without closing
+        them.
+        """
+        from django.db import connection
+        from siteconfig.prefork import post_fork
+
+        class Inherited(object):
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        real, inherited = connection.connection, Inherited()
+        connection.connection = inherited
+        try:
+            post_fork()
+            self.assertTrue(connection.connection is None)
+            self.assertFalse(inherited.closed)
+        finally:
+            connection.connection = real
+
+
+class RequestStatsTest(TestCase):
+    def setUp(self):
+        from siteconfig import middleware
+        middleware.reset()
+
+    def test_requests_are_recorded(self):
+        """
+        Tests that the requests are counted per view, in the right bucket.
+        """
+        from siteconfig import middleware
+
+        self.client.get('/')
+        self.client.get('/')
+        # Redirected to /_stats/ by the CommonMiddleware
+        self.client.get('/_stats')
+        views = middleware.snapshot()['views']
+        index = views['twist.views.index']
+        self.assertEqual(index['count'], 2)
+        self.assertEqual(index['errors'], 0)
+        self.assertEqual(sum(index['buckets']), 2)
+        self.assertTrue(index['bytes'] > 0)
+        self.assertEqual(views[middleware.UNRESOLVED]['count'], 1)
+
+        middleware.record('view', 0.003, 500, 10)
+        entry = middleware.snapshot()['views']['view']
+        self.assertEqual(entry['errors'], 1)
+        self.assertEqual(entry['buckets'][middleware.BUCKETS.index(5)], 1)
+
+    def test_stats_view_is_protected(self):
+        """
+        Tests that only the staff and the internal IPs see the statistics.
+        """
+        from django.contrib.auth.models import User
+
+        self.assertEqual(self.client.get('/_stats/').status_code, 404)
+        with override_settings(INTERNAL_IPS=('127.0.0.1',)):
+            response = self.client.get('/_stats/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+        User.objects.create_user('staff', 'staff@example.com', 'secret')
+        User.objects.filter(username='staff').update(is_staff=True)
+        self.client.login(username='staff', password='secret')
+        self.assertEqual(self.client.get('/_stats/').status_code, 200)
+
+
+class QueryStatsTest(TestCase):
+    def test_repeated_queries_are_logged(self):
+        """
+        Tests that the queries of a request are recorded with DEBUG off, and
+        that the repeated ones are logged.
+        """
+        import logging
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from siteconfig.middleware import QueryStatsMiddleware
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        records = []
+        handler = Handler()
+        logger = logging.getLogger('twist.sql')
+        handlers, logger.handlers = logger.handlers, [handler]
+        try:
+            with override_settings(DEBUG=False, SQL_REPEAT_THRESHOLD=3):
+                middleware = QueryStatsMiddleware()
+                request = RequestFactory().get('/')
+                middleware.process_request(request)
+                for pk in range(5):
+                    User.objects.filter(pk=pk).exists()
+                middleware.process_response(request, HttpResponse())
+        finally:
+            logger.handlers = handlers
+
+        self.assertEqual(connection.queries, [])
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].levelno, logging.WARNING)
+        self.assertEqual(records[0].queries, 5)
+        self.assertTrue('repeated 5 times' in records[0].getMessage())
+
+    def test_summary_at_debug_level(self):
+        """
+        Tests that the other requests are summed up at the debug level, and
+        only formatted when it is enabled.
+        """
+        import logging
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from siteconfig.middleware import QueryStatsMiddleware
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        records = []
+        logger = logging.getLogger('twist.sql')
+        handlers, logger.handlers = logger.handlers, [Handler()]
+        level = logger.level
+        try:
+            middleware = QueryStatsMiddleware()
+            for debug in (False, True):
+                logger.setLevel(logging.DEBUG if debug else logging.WARNING)
+                request = RequestFactory().get('/page/')
+                middleware.process_request(request)
+                middleware.process_response(request, HttpResponse())
+        finally:
+            logger.handlers = handlers
+            logger.setLevel(level)
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].levelno, logging.DEBUG)
+        self.assertTrue(records[0].getMessage().startswith(
+            'GET /page/: 0 queries in '))
+
+    def test_shape(self):
+        """
+        Tests that statements differing by their literals have the same shape.
+        """
+        from siteconfig.sql import shape
+
+        self.assertEqual(shape("SELECT a FROM t WHERE b = 'x' AND c IN (1, 2)"),
+                         shape("SELECT a FROM t WHERE b = 'y' AND c IN (3)"))
+        self.assertEqual(shape('SELECT a FROM t WHERE b IN (%s, %s)'),
+                         'SELECT a FROM t WHERE b IN (...)')
+
+
+class QueuedAdminEmailTest(TestCase):
+    def test_errors_are_grouped(self):
+        """
+        Tests that the first of identical errors is mailed right away, and the
+        others once with their count, by a local SMTP server.
+        """
+        import asyncore
+        import logging
+        import smtpd
+        import sys
+        import threading
+        import time
+        from siteconfig.log_handlers import QueuedAdminEmailHandler
+
+        class SMTPServer(smtpd.SMTPServer):
+            def process_message(self, peer, mailfrom, rcpttos, data):
+                messages.append(data)
+
+        messages = []
+        server = SMTPServer(('127.0.0.1', 0), None)
+        # Runs until the server and its connections are closed
+        thread = threading.Thread(target=asyncore.loop,
+                                  kwargs={'timeout': 0.05})
+        thread.daemon = True
+        thread.start()
+
+        logger = logging.getLogger('twist.tests.errors')
+        logger.propagate = False
+        handler = QueuedAdminEmailHandler(window=60)
+        logger.addHandler(handler)
+        try:
+            with override_settings(
+                    EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                    EMAIL_HOST='127.0.0.1',
+                    EMAIL_PORT=server.socket.getsockname()[1],
+                    ADMINS=(('Admin', 'admin@example.com'),)):
+                start = time.time()
+                for i in range(5):
+                    try:
+                        raise ValueError('Broken %d' % i)
+                    except ValueError:
+                        logger.error('Internal error', exc_info=sys.exc_info())
+                logger.error('Other error')
+                self.assertTrue(time.time() - start < 1)
+                # Well before the end of the window
+                while len(messages) < 2 and time.time() - start < 10:
+                    time.sleep(0.05)
+                self.assertEqual(len(messages), 2)
+                handler.flush()
+        finally:
+            logger.removeHandler(handler)
+            server.close()
+            thread.join(5)
+
+        self.assertEqual(len(messages), 3)
+        self.assertTrue('ERROR: Internal error' in messages[0])
+        self.assertFalse('more times' in messages[0])
+        self.assertTrue('Broken 0' in messages[0])
+        self.assertTrue('ERROR: Other error' in messages[1])
+        self.assertTrue('[4 more times] ERROR: Internal error' in messages[2])
+
+
+class DBUpdateTest(TestCase):
+    def test_up_to_date_database(self):
+        """
+        Tests that nothing is done when no table or migration is pending.
+        """
+        from StringIO import StringIO
+        from django.core.management import call_command
+        from twist.management.commands.dbupdate import pending_work
+
+        self.assertEqual(pending_work(), ([], []))
+        out = StringIO()
+        call_command('dbupdate', stdout=out)
+        self.assertEqual(out.getvalue(), 'The database is up to date.\n')
+
+    def test_file_lock(self):
+        """
+        Tests that a second process waits for the lock to be released.
+        """
+        import tempfile
+        import threading
+        from twist.management.commands.dbupdate import file_lock
+
+        events = []
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+
+        def update():
+            with file_lock(path, lambda: events.append('waiting')):
+                events.append('updating')
+
+        try:
+            with file_lock(path, lambda: events.append('unexpected')):
+                thread = threading.Thread(target=update)
+                thread.start()
+                thread.join(0.5)
+                self.assertEqual(events, ['waiting'])
+            thread.join(5)
+        finally:
+            os.remove(path)
+        self.assertEqual(events, ['waiting', 'updating'])
+
+    def test_migrate_command(self):
+        """
+        Tests that the deploy targets fake the migrations whenever asked to,
+        with or without syncdb.
+        """
+        import deploy
+
+        target = deploy.BasicTarget()
+        self.assertEqual(target.get_migrate_command(), 'dbupdate')
+        self.assertEqual(target.get_migrate_command(do_syncdb=True),
+                         'dbupdate')
+        self.assertEqual(target.get_migrate_command(do_fake=True),
+                         'dbupdate --fake')
+        self.assertEqual(target.get_migrate_command(True, True),
+                         'dbupdate --fake --all')
+
+
+class BatchTest(TestCase):
+    def test_batch_stops_at_first_failure(self):
+        """
+        Tests that the commands of a batch run in order until one fails.
+        """
+        from StringIO import StringIO
+        from django.core.management import call_command
+
+        out, err = StringIO(), StringIO()
+        self.assertRaises(SystemExit, call_command, 'batch',
+                          'dbupdate -v 0', 'nosuchcommand', 'dbupdate',
+                          stdout=out, stderr=err)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], '==> [1/3] dbupdate -v 0')
+        self.assertTrue(lines[1].startswith('<== [1/3] dbupdate -v 0: ok'))
+        self.assertTrue(lines[3].startswith(
+            '<== [2/3] nosuchcommand: failed (1)'))
+        self.assertEqual(lines[4], 'Not run: dbupdate')
+        self.assertTrue('Unknown command' in err.getvalue())
+
+    def test_manage_tasks(self):
+        """
+        Tests that the manage tasks take the commands as arguments, or one
+        command as arguments=.
+        """
+        import fabfile
+        from fabric.api import env
+
+        class Target(object):
+            def run_django_manage_batch(self, commands):
+                batches.append(commands)
+
+        batches = []
+        old_target = env.get('deploy_target')
+        env['deploy_target'] = Target()
+        try:
+            fabfile.app_manage('syncdb --noinput', 'migrate')
+            fabfile.db_manage(arguments='migrate')
+            fabfile.static_manage('collectstatic --noinput')
+        finally:
+            env['deploy_target'] = old_target
+        self.assertEqual(batches, [('syncdb --noinput', 'migrate'),
+                                   ('migrate',),
+                                   ('collectstatic --noinput',)])
+
+
+class WheelhouseTest(TestCase):
+    def test_pip_install_command(self):
+        """
+        Tests the command installing the requirements, with and without a
+        wheelhouse.
+        """
+        import deploy
+
+        class Target(deploy.BasicTarget):
+            REPOSITORY_DIR = '/srv/repo'
+            VIRTUALENV_DIR = '/srv/venv'
+
+        target = Target()
+        self.assertEqual(
+            target._pip_install_command('abc'),
+            'source /srv/venv/bin/activate && pip install'
+            ' -r /srv/repo/requirements.txt'
+            ' && echo abc > /srv/venv/.requirements_sha1')
+        self.assertEqual(
+            target._pip_install_command('abc', update=True,
+                                        use_wheelhouse=True),
+            'find ~/.wheelhouse -mindepth 1 -maxdepth 1 ! -name abc'
+            ' -exec rm -rf {} + && source /srv/venv/bin/activate'
+            ' && pip install -U --no-index --find-links ~/.wheelhouse/abc'
+            ' -r /srv/repo/requirements.txt'
+            ' && echo abc > /srv/venv/.requirements_sha1')
+
+
+class ReleaseSwitchTest(TestCase):
+    def test_rollback_and_pruning_follow_the_switches(self):
+        """
+        Tests that a rollback goes back to the release that was current
+        before, not to a newer release that was never activated, and that the
+        releases are pruned by the order they were made current.
+        """
+        import shutil
+        import subprocess
+        import tempfile
+        import deploy
+
+        class Target(deploy.ReleaseTarget):
+            PROJECT_DIR = tempfile.mkdtemp()
+            KEEP_RELEASES = 2
+
+        target = Target()
+        releases = target._get_releases_dir()
+
+        def shell(command):
+            subprocess.check_call(['bash', '-c', command])
+
+        def prepare(release):
+            os.makedirs(os.path.join(releases, release))
+            open(os.path.join(releases, release, '.prepared'), 'w').close()
+
+        def activate(release):
+            prepare(release)
+            shell('sha=%s && %s && %s' % (release,
+                                          target._switch_command('sha'),
+                                          target._prune_command()))
+
+        def current():
+            return os.path.basename(os.readlink(target._get_project_dir()))
+
+        try:
+            for release in ('a', 'b', 'c'):
+                activate(release)
+            self.assertEqual(sorted(os.listdir(releases)), ['b', 'c'])
+
+            # Prepared, but the deploy stopped before activating it
+            prepare('z')
+            shell('previous=$(basename $(readlink %s)) && %s'
+                  % (target._get_previous_link(),
+                     target._switch_command('previous')))
+            self.assertEqual(current(), 'b')
+
+            activate('d')
+            self.assertEqual(current(), 'd')
+            self.assertEqual(sorted(os.listdir(releases)), ['b', 'd'])
+        finally:
+            shutil.rmtree(Target.PROJECT_DIR)
+
+
+class ParallelTargetTest(TestCase):
+    def test_pool_sizes(self):
+        import deploy
+
+        class Target(deploy.BasicTarget):
+            POOL_SIZE = 4
+            ROLE_POOL_SIZES = {'app': 10}
+
+        self.assertEqual(deploy.BasicTarget().get_pool_size('app'), None)
+        self.assertEqual(Target().get_pool_size('app'), 10)
+        self.assertEqual(Target().get_pool_size('db'), 4)
+
+
+class RemoteProbeTest(TestCase):
+    def test_parse_probe(self):
+        import deploy
+
+        target = deploy.BasicTarget()
+        state = target._parse_probe('')
+        self.assertEqual(state, {
+            'ssh_key': False, 'venv': False, 'venv_requirements': '',
+            'wheelhouses': [], 'repo': False, 'dirty': False,
+            'branch': '(none)', 'head': '', 'requirements': ''})
+
+        state = target._parse_probe(
+            'ssh_key=1\nvenv=1\nwheelhouses=\nrepo=1\n'
+            'branch=refs/heads/master\nhead=abc\nnot a fact\n')
+        self.assertTrue(state['ssh_key'] and state['venv'] and state['repo'])
+        self.assertFalse(state['dirty'])
+        self.assertEqual(state['wheelhouses'], [])
+        self.assertEqual(state['branch'], 'master')
+        self.assertEqual(state['head'], 'abc')
+        self.assertEqual(state['requirements'], '')
+
+        state = target._parse_probe('wheelhouses=1a 2b\r\ndirty=1\r\n')
+        self.assertEqual(state['wheelhouses'], ['1a', '2b'])
+        self.assertTrue(state['dirty'])
+
+
+class RollingRestartTest(TestCase):
+    def test_restart_batches(self):
+        import deploy
+
+        class Target(deploy.BasicTarget):
+            RESTART_BATCH_SIZE = 2
+
+        target = Target()
+        hosts = ['a', 'b', 'c', 'd', 'e']
+        self.assertEqual(target.get_restart_batches(hosts),
+                         [['a', 'b'], ['c', 'd'], ['e']])
+        # Percentages are rounded up, to at least one host
+        target.RESTART_BATCH_SIZE = '25%'
+        self.assertEqual(target.get_restart_batches(hosts),
+                         [['a', 'b'], ['c', 'd'], ['e']])
+        target.RESTART_BATCH_SIZE = '10%'
+        self.assertEqual(target.get_restart_batches(hosts[:3]),
+                         [['a'], ['b'], ['c']])
+        target.RESTART_BATCH_SIZE = '100%'
+        self.assertEqual(target.get_restart_batches(hosts), [hosts])
+        target.RESTART_BATCH_SIZE = 0
+        self.assertEqual(len(target.get_restart_batches(hosts)), 5)
+        # No app host
+        self.assertEqual(target.get_restart_batches([]), [])
+
+
+
+class DeployTimingTest(TestCase):
+    def setUp(self):
+        import deploy_timing
+        self.deploy_timing = deploy_timing
+        deploy_timing.pop_records()
+
+    def tearDown(self):
+        self.deploy_timing.pop_records()
+
+    def test_records(self):
+        timing = self.deploy_timing
+        timing.record('a', 'git_pull', 1.5, execs=2, bytes_out=10)
+        self.assertEqual(timing.pop_records(), [{
+            'host': 'a', 'step': 'git_pull', 'seconds': 1.5, 'failed': False,
+            'execs': 2, 'bytes_out': 10, 'bytes_in': 0}])
+        self.assertEqual(timing.pop_records(), [])
+
+        # The records returned by the parallel tasks
+        timing.record('a', 'git_pull', 1)
+        timing.add_records([{'host': 'b', 'step': 'git_pull', 'seconds': 2}])
+        self.assertEqual([r['host'] for r in timing.pop_records()],
+                         ['a', 'b'])
+
+    def test_timed(self):
+        timing = self.deploy_timing
+
+        @timing.timed
+        def outer():
+            inner()
+
+        @timing.timed
+        def inner():
+            pass
+
+        @timing.timed
+        def broken():
+            raise ValueError
+
+        outer()
+        self.assertRaises(ValueError, broken)
+        self.assertEqual([(r['step'], r['failed'])
+                          for r in timing.pop_records()],
+                         [('outer', False), ('broken', True)])
+
+    def test_summary(self):
+        import sys
+        from StringIO import StringIO
+
+        for host, step, seconds in [('a', 'git_pull', 1), ('b', 'git_pull', 3),
+                                    ('a', 'restart_app', 2)]:
+            self.deploy_timing.record(host, step, seconds, execs=1)
+        records = self.deploy_timing.pop_records()
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.deploy_timing.print_summary(records, 6)
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        # The slowest steps first, then the totals of each host
+        steps = [line.split()[:3] for line in lines[2:5]]
+        self.assertEqual(steps, [['git_pull', 'b', '3.00'],
+                                 ['restart_app', 'a', '2.00'],
+                                 ['git_pull', 'a', '1.00']])
+        self.assertEqual([line.split() for line in lines[6:]],
+                         [['a', '3.00', '2'], ['b', '3.00', '1']])
+
+    def test_report(self):
+        import json
+        import shutil
+        import tempfile
+
+        self.deploy_timing.record('a', 'git_pull', 1)
+        records = self.deploy_timing.pop_records()
+        report_dir = os.path.join(tempfile.mkdtemp(), 'reports')
+        try:
+            path = self.deploy_timing.write_report('deploy', records,
+                                                   1000000000, 5, report_dir)
+            self.assertEqual(os.path.dirname(path), report_dir)
+            self.assertTrue(os.path.basename(path).startswith('deploy-'))
+            with open(path) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(os.path.dirname(report_dir))
+        self.assertEqual(report, {'task': 'deploy', 'started': 1000000000,
+                                  'seconds': 5, 'steps': records})
+
+class _StandInClient(object):
+    """
+    SSH client of DeployConnectionsTest.
+    """
+    def __init__(self, active=True):
+        self.active = active
+        self.closed = False
+
+    def get_transport(self):
+        client = self
+
+        class Transport(object):
+            def is_active(self):
+                return client.active
+        return Transport()
+
+    def close(self):
+        self.closed = True
+
+
+class DeployConnectionsTest(TestCase):
+    def setUp(self):
+        import deploy_connections
+        from fabric import state
+
+        self.deploy_connections = deploy_connections
+        self.old_cache, self.old_connect = (state.connections,
+                                            deploy_connections.connect)
+        self.connected = []
+        deploy_connections.install_reconnecting_cache()
+
+    def tearDown(self):
+        from fabric import operations, sftp, state
+        import deploy_timing
+
+        state.connections = operations.connections = sftp.connections = \
+            self.old_cache
+        self.deploy_connections.connect = self.old_connect
+        deploy_timing.pop_records()
+
+    def test_install(self):
+        from fabric import operations, sftp, state
+
+        cache = state.connections
+        self.assertTrue(isinstance(cache,
+                                   self.deploy_connections
+                                   .ReconnectingConnectionCache))
+        self.assertTrue(operations.connections is cache)
+        self.assertTrue(sftp.connections is cache)
+        self.deploy_connections.install_reconnecting_cache()
+        self.assertTrue(state.connections is cache)
+
+    def test_dead_connections_are_replaced(self):
+        from fabric import state
+
+        new_client = _StandInClient()
+        cache = state.connections
+        cache.connect = lambda key: dict.__setitem__(cache, key, new_client)
+        dead = _StandInClient(active=False)
+        dict.__setitem__(cache, 'demo@server.example.com:22', dead)
+
+        self.assertTrue(cache['demo@server.example.com'] is new_client)
+        self.assertTrue(dead.closed)
+        # Active connections are kept
+        self.assertTrue(cache['demo@server.example.com'] is new_client)
+
+    def test_warm_up(self):
+        from fabric import state
+
+        def connect(user, host, port):
+            if host == 'down.example.com':
+                raise IOError('Connection refused')
+            client = _StandInClient()
+            self.connected.append(('%s@%s:%s' % (user, host, port), client))
+            return client
+        self.deploy_connections.connect = connect
+
+        failures = self.deploy_connections.warm_up(
+            ['demo@server.example.com', 'demo@server.example.com:22',
+             'demo@down.example.com'])
+        self.assertEqual(failures.keys(), ['demo@down.example.com'])
+        self.assertEqual([key for key, client in self.connected],
+                         ['demo@server.example.com:22'])
+        # Found by Fabric, without connecting again
+        client = self.connected[0][1]
+        self.assertTrue(state.connections['demo@server.example.com']
+                        is client)
+        self.assertEqual(self.deploy_connections.warm_up(
+            ['demo@server.example.com']), {})
+        self.assertEqual(len(self.connected), 1)
+
+
+class BundleTest(TestCase):
+    def test_build_bundle(self):
+        """
+        Tests that the bundles have the commits of the branch missing from
+        their basis, or all of them.
+        """
+        import shutil
+        import subprocess
+        import tempfile
+        import deploy
+        from fabric.api import hide, lcd, settings
+
+        tmp_dir = tempfile.mkdtemp()
+        repo = os.path.join(tmp_dir, 'repo')
+
+        def git(*args):
+            return subprocess.check_output(
+                ('git', '-c', 'user.name=Test', '-c', 'user.email=test@test',
+                 '-C', repo) + args).strip()
+
+        class Target(deploy.BasicTarget):
+            GIT_BRANCH = 'master'
+            LOCAL_BUNDLE_DIR = os.path.join(tmp_dir, 'bundles')
+
+        try:
+            subprocess.check_call(['git', 'init', '-q', repo])
+            git('checkout', '-q', '-b', 'master')
+            git('commit', '-q', '--allow-empty', '-m', 'first')
+            basis = git('rev-parse', 'HEAD')
+            git('commit', '-q', '--allow-empty', '-m', 'second')
+            head = git('rev-parse', 'HEAD')
+
+            target = Target()
+            with settings(hide('everything')), lcd(repo):
+                full = target.build_bundle()
+                partial = target.build_bundle(basis)
+                unknown = target.build_bundle('0' * 40)
+                self.assertEqual(target.build_bundle(basis), partial)
+
+            self.assertEqual(os.path.basename(full),
+                             'full-%s.bundle' % head[:12])
+            self.assertEqual(os.path.basename(partial),
+                             '%s-%s.bundle' % (basis[:12], head[:12]))
+            self.assertEqual(unknown, full)
+            for bundle in (full, partial):
+                self.assertEqual(git('bundle', 'list-heads', bundle),
+                                 '%s refs/heads/master' % head)
+            # Only the partial bundle needs the basis
+            self.assertFalse(basis in git('bundle', 'verify', full))
+            self.assertTrue(basis in git('bundle', 'verify', partial))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -2,6 +2,9 @@
 from django.http import HttpResponse
 from django.conf import settings
 
+from siteconfig.cache import cache_versioned_page
+
+@cache_versioned_page(60)
 def index(request):
     return HttpResponse('TWIST System comming soon. This is a %s environment'
                         % settings.DJANGO_DEPLOY_ENV)